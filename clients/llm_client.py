@@ -3,9 +3,29 @@ LLM客户端 - 统一的LLM API调用接口
 """
 
 import json
-from typing import Dict, Any, Tuple, Optional
+import asyncio
+from typing import Dict, Any, AsyncIterator, List, Tuple, Optional
 from abc import ABC, abstractmethod
 
+# 可选加速：orjson为C实现，解析数KB的LLM响应比stdlib json快数倍
+# 未安装时自动回退stdlib json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 一次性导入依赖，避免热路径上每次调用都执行import语句
+# 缺失时延迟到实际使用对应提供商才报错
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import openai
+except ImportError:
+    openai = None
+
 
 class BaseLLMProvider(ABC):
     """LLM提供商基类"""
@@ -15,6 +35,22 @@ class BaseLLMProvider(ABC):
         """生成文本"""
         pass
 
+    async def aclose(self):
+        """释放网络资源（默认无操作，由具体提供商覆盖）"""
+        pass
+
+    async def generate_stream(self, prompt: str, **kwargs) -> AsyncIterator[str]:
+        """
+        流式生成文本 - 逐块产出增量内容，失败时抛出异常
+
+        默认实现退化为一次性生成后整体产出，具体提供商覆盖为真正的
+        增量流式。
+        """
+        success, content = await self.generate(prompt, **kwargs)
+        if not success:
+            raise RuntimeError(content)
+        yield content
+
 
 class OpenAIProvider(BaseLLMProvider):
     """OpenAI格式提供商"""
@@ -24,23 +60,47 @@ class OpenAIProvider(BaseLLMProvider):
         self.api_key = config.get("api_key")
         self.base_url = config.get("base_url", "https://api.openai.com/v1")
         self.model_id = config.get("model_id")
+        # 复用的OpenAI客户端（惰性创建，避免每次调用重建连接池）
+        self._client = None
 
-    async def generate(self, prompt: str, **kwargs) -> Tuple[bool, str]:
-        """使用OpenAI API生成文本"""
-        try:
-            import openai
+    def _client_instance(self):
+        """获取共享的openai.AsyncOpenAI客户端（惰性创建，复用连接池）"""
+        if self._client is None:
+            if openai is None:
+                raise RuntimeError("openai库未安装，无法使用OpenAI提供商")
 
-            client = openai.AsyncOpenAI(
+            self._client = openai.AsyncOpenAI(
                 api_key=self.api_key,
-                base_url=self.base_url
+                base_url=self.base_url,
+                max_retries=2,
+                timeout=30.0,
             )
+        return self._client
+
+    async def aclose(self):
+        """关闭共享的OpenAI客户端"""
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    async def generate(self, prompt: str, **kwargs) -> Tuple[bool, str]:
+        """使用OpenAI API生成文本"""
+        try:
+            client = self._client_instance()
 
             temperature = kwargs.get("temperature", 0.3)
             max_tokens = kwargs.get("max_tokens", 200)
 
+            # 静态指令放进system消息，在调用间字节级一致，便于服务端
+            # 做提示词前缀/KV缓存
+            messages = [{"role": "user", "content": prompt}]
+            system = kwargs.get("system")
+            if system:
+                messages.insert(0, {"role": "system", "content": system})
+
             response = await client.chat.completions.create(
                 model=self.model_id,
-                messages=[{"role": "user", "content": prompt}],
+                messages=messages,
                 temperature=temperature,
                 max_tokens=max_tokens
             )
@@ -51,6 +111,27 @@ class OpenAIProvider(BaseLLMProvider):
         except Exception as e:
             return False, f"OpenAI API调用失败: {str(e)}"
 
+    async def generate_stream(self, prompt: str, **kwargs) -> AsyncIterator[str]:
+        """使用OpenAI API流式生成文本，边生成边产出增量"""
+        client = self._client_instance()
+
+        temperature = kwargs.get("temperature", 0.3)
+        max_tokens = kwargs.get("max_tokens", 200)
+
+        stream = await client.chat.completions.create(
+            model=self.model_id,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True
+        )
+
+        async for chunk in stream:
+            if chunk.choices:
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+
 
 class CustomProvider(BaseLLMProvider):
     """自定义API提供商"""
@@ -61,6 +142,39 @@ class CustomProvider(BaseLLMProvider):
         # 统一使用 base_url 字段，兼容用户配置习惯
         self.base_url = config.get("base_url", "").rstrip("/")
         self.model_id = config.get("model_id")
+        # 复用的HTTP客户端（惰性创建，避免每次调用重建连接池）
+        self._client = None
+        self._client_lock = None
+
+    async def _get_client(self):
+        """获取共享的httpx.AsyncClient（惰性创建，复用TCP连接）"""
+        if self._client is not None:
+            return self._client
+
+        if httpx is None:
+            raise RuntimeError("httpx库未安装，无法使用自定义API提供商")
+
+        # 锁也需要在事件循环内惰性创建
+        if self._client_lock is None:
+            self._client_lock = asyncio.Lock()
+
+        async with self._client_lock:
+            if self._client is None:
+                self._client = httpx.AsyncClient(
+                    limits=httpx.Limits(
+                        max_connections=100,
+                        max_keepalive_connections=20,
+                        keepalive_expiry=30,
+                    ),
+                    timeout=httpx.Timeout(30.0, connect=5.0),
+                )
+        return self._client
+
+    async def aclose(self):
+        """关闭共享的HTTP客户端"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
 
     def _get_endpoint(self) -> str:
         """
@@ -90,45 +204,97 @@ class CustomProvider(BaseLLMProvider):
     async def generate(self, prompt: str, **kwargs) -> Tuple[bool, str]:
         """使用自定义API生成文本"""
         try:
-            import httpx
-
             # 获取完整端点URL
             endpoint = self._get_endpoint()
 
             temperature = kwargs.get("temperature", 0.3)
             max_tokens = kwargs.get("max_tokens", 200)
 
-            async with httpx.AsyncClient(timeout=30) as client:
-                response = await client.post(
-                    endpoint,
-                    headers={
-                        "Authorization": f"Bearer {self.api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": self.model_id,
-                        "messages": [{"role": "user", "content": prompt}],
-                        "temperature": temperature,
-                        "max_tokens": max_tokens
-                    }
-                )
+            # 同OpenAIProvider：静态指令单独作为system消息发送
+            messages = [{"role": "user", "content": prompt}]
+            system = kwargs.get("system")
+            if system:
+                messages.insert(0, {"role": "system", "content": system})
+
+            payload = {
+                "model": self.model_id,
+                "messages": messages,
+                "temperature": temperature,
+                "max_tokens": max_tokens
+            }
+
+            # 复用共享客户端，避免每次请求重新握手
+            # 请求体预先编码为bytes，绕过httpx内部的stdlib json编码器
+            client = await self._get_client()
+            response = await client.post(
+                endpoint,
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json"
+                },
+                content=orjson.dumps(payload) if orjson else json.dumps(payload).encode("utf-8")
+            )
 
-                response.raise_for_status()
-                result = response.json()
+            response.raise_for_status()
+            result = orjson.loads(response.content) if orjson else response.json()
 
-                # 根据不同API格式解析
-                if "choices" in result:
-                    content = result["choices"][0]["message"]["content"]
-                elif "content" in result:
-                    content = result["content"]
-                else:
-                    return False, "API返回格式未知"
+            # 根据不同API格式解析
+            if "choices" in result:
+                content = result["choices"][0]["message"]["content"]
+            elif "content" in result:
+                content = result["content"]
+            else:
+                return False, "API返回格式未知"
 
-                return True, content
+            return True, content
 
         except Exception as e:
             return False, f"自定义API调用失败: {str(e)}"
 
+    async def generate_stream(self, prompt: str, **kwargs) -> AsyncIterator[str]:
+        """使用自定义API流式生成文本（SSE格式），边生成边产出增量"""
+        endpoint = self._get_endpoint()
+
+        temperature = kwargs.get("temperature", 0.3)
+        max_tokens = kwargs.get("max_tokens", 200)
+
+        client = await self._get_client()
+        async with client.stream(
+            "POST",
+            endpoint,
+            headers={
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json"
+            },
+            json={
+                "model": self.model_id,
+                "messages": [{"role": "user", "content": prompt}],
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+                "stream": True
+            }
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                line = line.strip()
+                if not line or not line.startswith("data:"):
+                    continue
+
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+
+                try:
+                    payload = json.loads(data)
+                except json.JSONDecodeError:
+                    continue
+
+                choices = payload.get("choices") or []
+                if choices:
+                    delta = choices[0].get("delta", {}).get("content")
+                    if delta:
+                        yield delta
+
 
 class LLMClient:
     """LLM客户端 - 统一的LLM调用接口"""
@@ -137,6 +303,12 @@ class LLMClient:
         self.config = config
         self.provider_type = config.get("provider_type", "openai")
         self.provider = self._create_provider()
+        # 并发上限信号量（惰性创建，需在事件循环内初始化）
+        self._sem = None
+        # 配置校验只做一次，热路径直接复用结果
+        self._config_error: Optional[str] = None
+        if not config.get("api_key") or not config.get("model_id"):
+            self._config_error = "LLM未配置: 缺少api_key或model_id"
 
     def _create_provider(self) -> BaseLLMProvider:
         """创建提供商实例"""
@@ -147,13 +319,64 @@ class LLMClient:
         else:
             raise ValueError(f"不支持的提供商类型: {self.provider_type}")
 
+    @property
+    def is_configured(self) -> bool:
+        """LLM是否已正确配置 - 热路径调用方可据此在await前短路"""
+        return self._config_error is None
+
     async def generate(self, prompt: str, **kwargs) -> Tuple[bool, str]:
         """生成文本"""
-        if not self.config.get("api_key") or not self.config.get("model_id"):
-            return False, "LLM未配置: 缺少api_key或model_id"
+        if self._config_error:
+            return False, self._config_error
 
         return await self.provider.generate(prompt, **kwargs)
 
+    async def generate_stream(self, prompt: str, **kwargs) -> AsyncIterator[str]:
+        """
+        流式生成文本 - 逐块产出增量内容
+
+        调用方可以边接收边解析（如检测到完整JSON即提前停止）；只需要
+        完整结果时用 ''.join([c async for c in ...]) 聚合。
+        """
+        if self._config_error:
+            raise ValueError(self._config_error)
+
+        async for chunk in self.provider.generate_stream(prompt, **kwargs):
+            yield chunk
+
+    async def generate_many(self, prompts: List[str], **kwargs) -> List[Tuple[bool, str]]:
+        """
+        并发生成多条文本 - 受信号量限制的扇出调用
+
+        Args:
+            prompts: 提示词列表
+            **kwargs: 透传给generate的参数
+
+        Returns:
+            与prompts顺序对应的(是否成功, 内容)列表
+        """
+        if not prompts:
+            return []
+
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.config.get("max_concurrency", 8))
+
+        async def _one(prompt: str) -> Tuple[bool, str]:
+            async with self._sem:
+                return await self.generate(prompt, **kwargs)
+
+        results = await asyncio.gather(*[_one(p) for p in prompts], return_exceptions=True)
+
+        # 异常统一转换为失败结果，保持返回格式一致
+        return [
+            r if not isinstance(r, BaseException) else (False, f"LLM调用异常: {str(r)}")
+            for r in results
+        ]
+
+    async def aclose(self):
+        """关闭提供商持有的网络资源（优雅停机用）"""
+        await self.provider.aclose()
+
     async def generate_impression_analysis(self, prompt: str) -> Tuple[bool, str]:
         """生成印象分析 - 专用接口"""
         # 进一步增大max_tokens，确保有足够的空间返回完整的JSON
@@ -161,12 +384,80 @@ class LLMClient:
         # 增大到2000，避免响应被截断
         return await self.generate(prompt, temperature=0.3, max_tokens=2000)
 
+    # 单次请求内打包的最大任务数，避免超出模型token限制
+    IMPRESSION_BATCH_LIMIT = 6
+
+    async def generate_impression_analysis_batch(self, prompts: List[str]) -> List[Tuple[bool, str]]:
+        """
+        批量生成印象分析 - 将多个独立提示词打包进一次LLM请求
+
+        把N个任务合并为一条消息并要求返回JSON数组，摊薄每次请求的
+        网络往返和prefill开销。超过IMPRESSION_BATCH_LIMIT的任务自动
+        分批发送。
+
+        Args:
+            prompts: 各用户的印象分析提示词列表
+
+        Returns:
+            与prompts顺序对应的(是否成功, 内容)列表
+        """
+        if not prompts:
+            return []
+
+        # 单条任务直接走原有接口
+        if len(prompts) == 1:
+            return [await self.generate_impression_analysis(prompts[0])]
+
+        results: List[Tuple[bool, str]] = []
+        for start in range(0, len(prompts), self.IMPRESSION_BATCH_LIMIT):
+            chunk = prompts[start:start + self.IMPRESSION_BATCH_LIMIT]
+            results.extend(await self._generate_impression_chunk(chunk))
+        return results
+
+    async def _generate_impression_chunk(self, prompts: List[str]) -> List[Tuple[bool, str]]:
+        """执行一批打包后的印象分析任务"""
+        n = len(prompts)
+        task_lines = "\n\n".join(
+            f"任务{i + 1}: {prompt}" for i, prompt in enumerate(prompts)
+        )
+        batch_prompt = (
+            f"以下是{n}个互相独立的印象分析任务。请依次完成每个任务，"
+            f"只返回一个包含{n}个字符串的JSON数组，数组第i个元素是任务i的结果，"
+            f"不要返回其他内容。\n\n{task_lines}"
+        )
+
+        success, content = await self.generate(
+            batch_prompt, temperature=0.3, max_tokens=2000 * n
+        )
+
+        if not success:
+            return [(False, content)] * n
+
+        # 解析JSON数组（允许模型在数组外带少量说明文字）
+        try:
+            start = content.find('[')
+            end = content.rfind(']')
+            if start < 0 or end <= start:
+                raise ValueError("响应中未找到JSON数组")
+
+            items = json.loads(content[start:end + 1])
+            if not isinstance(items, list) or len(items) != n:
+                raise ValueError(f"JSON数组长度不符: 期望{n}, 实际{len(items) if isinstance(items, list) else '非数组'}")
+
+            return [(True, str(item)) for item in items]
+        except Exception as e:
+            return [(False, f"批量响应解析失败: {str(e)}")] * n
+
     async def generate_affection_analysis(self, prompt: str) -> Tuple[bool, str]:
         """生成好感度分析 - 专用接口"""
         # 增大max_tokens，确保返回完整的JSON
         return await self.generate(prompt, temperature=0.3, max_tokens=1500)
 
-    async def generate_weight_evaluation(self, prompt: str) -> Tuple[bool, str]:
-        """生成权重评估 - 专用接口"""
+    async def generate_weight_evaluation(self, prompt: str, system: Optional[str] = None) -> Tuple[bool, str]:
+        """生成权重评估 - 专用接口
+
+        system传入固定不变的评估说明，作为独立的system消息发送，
+        让支持前缀缓存的服务端跨请求复用这部分的KV状态。
+        """
         # 增大max_tokens
-        return await self.generate(prompt, temperature=0.2, max_tokens=1000)
+        return await self.generate(prompt, temperature=0.2, max_tokens=1000, system=system)
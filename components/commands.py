@@ -5,7 +5,7 @@
 from typing import Optional, List
 from src.plugin_system import BaseCommand
 
-from ..models import UserImpression, UserMessageState
+from ..models import db, UserImpression, UserMessageState
 from ..utils.helpers import get_affection_level
 
 class BaseImpressionCommand(BaseCommand):
@@ -65,18 +65,20 @@ class ViewImpressionCommand(BaseImpressionCommand):
                 await self.send_text("请提供用户ID")
                 return False, "请提供用户ID", False
 
-            # 从数据库获取印象
-            impression = UserImpression.select().where(
-                UserImpression.user_id == user_id
-            ).first()
+            # 印象和消息状态放在同一事务内读取，避免两次自动提交的锁开销
+            with db.atomic():
+                impression = UserImpression.select().where(
+                    UserImpression.user_id == user_id
+                ).first()
+
+                if impression:
+                    # 获取消息状态
+                    state = UserMessageState.get_or_create(user_id=user_id)[0]
 
             if not impression:
                 await self.send_text(f"暂无用户 {user_id} 的印象数据")
                 return False, f"暂无用户 {user_id} 的印象数据", False
 
-            # 获取消息状态
-            state = UserMessageState.get_or_create(user_id=user_id)[0]
-
             # 获取印象摘要
             impression_summary = impression.get_impression_summary()
 
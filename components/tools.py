@@ -3,15 +3,89 @@
 """
 
 import json
+import time
+import asyncio
 import logging
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple
 from src.plugin_system import BaseTool, ToolParamType
 
 from ..models import UserImpression
+from ..models.database import db
 from ..services import TextImpressionService
 
 logger = logging.getLogger("impression_affection_system")
 
+# 印象查询TTL缓存 - 同一会话内重复查询同一用户时跳过SQLite
+# {user_id: (过期时间戳, UserImpression对象)}
+_IMPRESSION_CACHE: Dict[str, Tuple[float, Any]] = {}
+_IMPRESSION_CACHE_TTL = 30.0  # 秒
+_IMPRESSION_CACHE_MAXSIZE = 2048
+
+
+def _cache_get_impression(user_id: str) -> Optional[UserImpression]:
+    """从TTL缓存获取用户印象，过期或未命中返回None"""
+    entry = _IMPRESSION_CACHE.get(user_id)
+    if entry is None:
+        return None
+
+    expires_at, impression = entry
+    if time.monotonic() >= expires_at:
+        _IMPRESSION_CACHE.pop(user_id, None)
+        return None
+
+    return impression
+
+
+def _cache_put_impression(user_id: str, impression: UserImpression):
+    """写入TTL缓存，超出容量时先清理过期项再淘汰最旧项"""
+    if len(_IMPRESSION_CACHE) >= _IMPRESSION_CACHE_MAXSIZE:
+        now = time.monotonic()
+        expired = [uid for uid, (exp, _) in _IMPRESSION_CACHE.items() if now >= exp]
+        for uid in expired:
+            _IMPRESSION_CACHE.pop(uid, None)
+        # 清理后仍然满，淘汰最早写入的条目（dict保持插入顺序）
+        while len(_IMPRESSION_CACHE) >= _IMPRESSION_CACHE_MAXSIZE:
+            _IMPRESSION_CACHE.pop(next(iter(_IMPRESSION_CACHE)), None)
+
+    _IMPRESSION_CACHE[user_id] = (time.monotonic() + _IMPRESSION_CACHE_TTL, impression)
+
+
+# 工具读取路径实际用到的列投影 - 跳过其余7个长TEXT维度字段的取回与实例化
+_IMPRESSION_READ_FIELDS = (
+    UserImpression.user_id,
+    UserImpression.personality_traits,
+    UserImpression.affection_score,
+    UserImpression.affection_level,
+    UserImpression.message_count,
+    UserImpression.updated_at,
+)
+
+
+async def _db_first(query):
+    """在工作线程中执行peewee查询的first()，避免阻塞事件循环"""
+    def _run():
+        # 连接池连接按线程归属，执行器线程用完必须显式归还，
+        # 否则每个工作线程永久占用一个池槽位，耗尽后新线程拿不到连接
+        try:
+            return query.first()
+        finally:
+            db.close()
+
+    return await asyncio.to_thread(_run)
+
+
+def invalidate_impression_cache(user_id: str = None):
+    """
+    失效印象缓存 - 印象/好感度写入后由服务层调用
+
+    Args:
+        user_id: 要失效的用户ID，为None时清空整个缓存
+    """
+    if user_id is None:
+        _IMPRESSION_CACHE.clear()
+    else:
+        _IMPRESSION_CACHE.pop(user_id, None)
+
 
 def resolve_user_id_from_nickname(nickname: str, platform: str = "qq") -> Optional[str]:
     """从昵称解析用户的真实QQ号
@@ -99,7 +173,7 @@ class GetUserImpressionTool(BaseTool):
 
             # 如果传入的不是纯数字（QQ号），尝试从昵称解析
             if not user_id.isdigit():
-                resolved_user_id = resolve_user_id_from_nickname(user_id)
+                resolved_user_id = await asyncio.to_thread(resolve_user_id_from_nickname, user_id)
                 if resolved_user_id:
                     logger.debug(f"从昵称解析到QQ号: {user_id} -> {resolved_user_id}")
                     user_id = resolved_user_id
@@ -112,16 +186,20 @@ class GetUserImpressionTool(BaseTool):
             logger.debug(f"查询用户 {normalized_user_id} 的印象数据 (原始ID: {user_id})")
 
             # 仅使用精确匹配，禁用模糊匹配以防止错误匹配
-            impression = None
+            # 先查TTL缓存，命中时跳过数据库查询
+            impression = _cache_get_impression(normalized_user_id)
 
-            # 直接精确匹配（使用标准化ID）
-            try:
-                impression = UserImpression.select().where(
-                    UserImpression.user_id == normalized_user_id
-                ).first()
-            except Exception as db_error:
-                logger.error(f"精确匹配失败: {str(db_error)}")
-                impression = None
+            if impression is None:
+                # 直接精确匹配（使用标准化ID），查询放入工作线程避免阻塞事件循环
+                try:
+                    impression = await _db_first(UserImpression.select(*_IMPRESSION_READ_FIELDS).where(
+                        UserImpression.user_id == normalized_user_id
+                    ))
+                    if impression:
+                        _cache_put_impression(normalized_user_id, impression)
+                except Exception as db_error:
+                    logger.error(f"精确匹配失败: {str(db_error)}")
+                    impression = None
 
             if impression:
                 # 记录查询成功日志
@@ -197,7 +275,7 @@ class SearchImpressionsTool(BaseTool):
 
             # 如果传入的不是纯数字（QQ号），尝试从昵称解析
             if not user_id.isdigit():
-                resolved_user_id = resolve_user_id_from_nickname(user_id)
+                resolved_user_id = await asyncio.to_thread(resolve_user_id_from_nickname, user_id)
                 if resolved_user_id:
                     logger.debug(f"从昵称解析到QQ号: {user_id} -> {resolved_user_id}")
                     user_id = resolved_user_id
@@ -208,10 +286,14 @@ class SearchImpressionsTool(BaseTool):
             from ..services.database_service import DatabaseService
             normalized_user_id = DatabaseService.normalize_user_id(user_id)
 
-            # 获取用户的印象数据
-            impression = UserImpression.select().where(
-                UserImpression.user_id == normalized_user_id
-            ).first()
+            # 获取用户的印象数据（先查TTL缓存，查询放入工作线程）
+            impression = _cache_get_impression(normalized_user_id)
+            if impression is None:
+                impression = await _db_first(UserImpression.select(*_IMPRESSION_READ_FIELDS).where(
+                    UserImpression.user_id == normalized_user_id
+                ))
+                if impression:
+                    _cache_put_impression(normalized_user_id, impression)
 
             if not impression:
                 return {
@@ -3,9 +3,26 @@
 """
 
 import os
-from peewee import SqliteDatabase
+from playhouse.pool import PooledSqliteDatabase
 
 PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DB_PATH = os.path.join(PLUGIN_DIR, "impression_affection_data.db")
 
-db = SqliteDatabase(DB_PATH)
+# WAL模式允许写入时并发读取，配合更大的页缓存减少重复查询的磁盘I/O
+# 连接池让每个线程复用自己的连接（to_thread里的查询不再反复开关连接，
+# 也不会与事件循环线程争抢同一个连接）；长连接场景下请使用
+# db.connect(reuse_if_open=True) 复用连接
+db = PooledSqliteDatabase(
+    DB_PATH,
+    max_connections=8,
+    stale_timeout=300,
+    pragmas={
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "cache_size": -64000,
+        "foreign_keys": 1,
+        "temp_store": "memory",
+        "mmap_size": 268435456,
+        "busy_timeout": 5000,
+    },
+)
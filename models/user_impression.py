@@ -2,6 +2,8 @@
 用户印象模型
 """
 
+from types import MappingProxyType
+
 from peewee import Model, TextField, FloatField, IntegerField, DateTimeField
 from datetime import datetime
 from .database import db
@@ -35,6 +37,9 @@ class UserImpression(Model):
     message_count = IntegerField(default=0)  # 累计消息数
     last_interaction = DateTimeField(default=datetime.now)  # 最后交互时间
 
+    # 写入时预生成的印象摘要（读路径直接取用，避免每次读取重新拼接8个维度）
+    impression_summary_cached = TextField(default="")
+
     # 印象版本控制
     impression_version = IntegerField(default=1)  # 印象版本号
     previous_impression = TextField(default="")  # 上一次的印象(用于对比)
@@ -49,8 +54,14 @@ class UserImpression(Model):
         table_name = "user_impressions"
         indexes = (
             (('user_id', 'updated_at'), False),  # 复合索引用于查询
+            (('updated_at',), False),  # 单列索引：按更新时间排序的查询无法使用上面的复合索引
         )
 
+    def save(self, *args, **kwargs):
+        """保存时刷新预生成的印象摘要，把格式化成本移到低频的写路径"""
+        self.impression_summary_cached = self._render_impression_summary()
+        return super().save(*args, **kwargs)
+
     def update_timestamps(self):
         """更新时间戳"""
         self.updated_at = datetime.now()
@@ -90,58 +101,56 @@ class UserImpression(Model):
         return f"从版本 {self.impression_version - 1} 更新到版本 {self.impression_version}"
 
     def get_impression_summary(self) -> str:
-        """获取印象摘要"""
-        dimensions = []
-
-        if self.personality_traits.strip():
-            dimensions.append(f"性格: {self.personality_traits}")
-        if self.interests_hobbies.strip():
-            dimensions.append(f"兴趣: {self.interests_hobbies}")
-        if self.communication_style.strip():
-            dimensions.append(f"交流: {self.communication_style}")
-        if self.emotional_tendencies.strip():
-            dimensions.append(f"情感: {self.emotional_tendencies}")
-        if self.behavioral_patterns.strip():
-            dimensions.append(f"行为: {self.behavioral_patterns}")
-        if self.values_attitudes.strip():
-            dimensions.append(f"价值观: {self.values_attitudes}")
-        if self.relationship_preferences.strip():
-            dimensions.append(f"关系: {self.relationship_preferences}")
-        if self.growth_development.strip():
-            dimensions.append(f"成长: {self.growth_development}")
+        """获取印象摘要（优先使用写入时预生成的缓存）"""
+        if self.impression_summary_cached:
+            return self.impression_summary_cached
+
+        # 缓存为空（迁移前的旧记录），退回实时拼接
+        return self._render_impression_summary()
+
+    # 摘要展示用的(字段名, 标签)对，按展示顺序排列
+    SUMMARY_DIMENSION_PAIRS = (
+        ("personality_traits", "性格"),
+        ("interests_hobbies", "兴趣"),
+        ("communication_style", "交流"),
+        ("emotional_tendencies", "情感"),
+        ("behavioral_patterns", "行为"),
+        ("values_attitudes", "价值观"),
+        ("relationship_preferences", "关系"),
+        ("growth_development", "成长"),
+    )
+
+    def _render_impression_summary(self) -> str:
+        """从各维度字段拼接印象摘要"""
+        # 每个字段只做一次getattr和strip，直接复用裁剪后的值
+        dimensions = [
+            f"{label}: {value}"
+            for field, label in self.SUMMARY_DIMENSION_PAIRS
+            if (value := (getattr(self, field) or "").strip())
+        ]
 
         return " | ".join(dimensions) if dimensions else "暂无印象数据"
 
+    # 维度名到字段名的映射（类级只读常量，避免每次调用重建dict）
+    DIMENSION_FIELD_MAP = MappingProxyType({
+        "personality": "personality_traits",
+        "interests": "interests_hobbies",
+        "communication": "communication_style",
+        "emotional": "emotional_tendencies",
+        "behavior": "behavioral_patterns",
+        "values": "values_attitudes",
+        "relationship": "relationship_preferences",
+        "growth": "growth_development"
+    })
+
     def set_dimension(self, dimension: str, content: str):
         """设置特定维度的内容"""
-        dimension_map = {
-            "personality": "personality_traits",
-            "interests": "interests_hobbies",
-            "communication": "communication_style",
-            "emotional": "emotional_tendencies",
-            "behavior": "behavioral_patterns",
-            "values": "values_attitudes",
-            "relationship": "relationship_preferences",
-            "growth": "growth_development"
-        }
-
-        if dimension in dimension_map:
-            setattr(self, dimension_map[dimension], content)
+        if dimension in self.DIMENSION_FIELD_MAP:
+            setattr(self, self.DIMENSION_FIELD_MAP[dimension], content)
             self.update_timestamps()
         else:
             raise ValueError(f"未知维度: {dimension}")
 
     def get_dimension(self, dimension: str) -> str:
         """获取特定维度的内容"""
-        dimension_map = {
-            "personality": "personality_traits",
-            "interests": "interests_hobbies",
-            "communication": "communication_style",
-            "emotional": "emotional_tendencies",
-            "behavior": "behavioral_patterns",
-            "values": "values_attitudes",
-            "relationship": "relationship_preferences",
-            "growth": "growth_development"
-        }
-
-        return getattr(self, dimension_map.get(dimension, ""), "")
+        return getattr(self, self.DIMENSION_FIELD_MAP.get(dimension, ""), "")
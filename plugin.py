@@ -6,8 +6,13 @@
 """
 
 from typing import List, Tuple, Type, Dict, Any, Optional
+from functools import cached_property
 import os
+import re
+import sys
+import time
 import asyncio
+import itertools
 
 from src.plugin_system import (
     BasePlugin,
@@ -46,6 +51,19 @@ from .components import (
 
 logger = get_logger("impression_affection_system")
 
+# 纯标点/表情消息匹配：ASCII标点、中文标点、常见表情符号区段
+# 这类消息必然是低权重，无需走LLM权重评估
+_TRIVIAL_MESSAGE_RE = re.compile(
+    r'^[\s!-/:-@\[-`{-~。，、；：？！…—·～“”‘’「」『』（）【】《》'
+    r'☀-➿️‍\U0001F000-\U0001FAFF]*$'
+)
+
+# 临时消息ID：启动时间戳 + 进程内单调计数器
+# 同一秒内的多条消息不再碰撞（秒级时间戳会把它们误判为已处理），
+# 且生成时不需要系统调用；十六进制格式让缓存键更短
+_MID_BASE = time.time_ns()
+_MID_COUNTER = itertools.count()
+
 
 class ImpressionUpdateHandler(BaseEventHandler):
     """自动更新用户印象和好感度的事件处理器"""
@@ -55,19 +73,38 @@ class ImpressionUpdateHandler(BaseEventHandler):
     handler_description = "每次LLM回复后更新用户印象和好感度"
     intercept_message = False
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.affection_service = None
-        self.weight_service = None
-        self.message_service = None
-        self.llm_client = None
-        self.text_impression_service = None
-        self._services_initialized = False
+    # 各服务用cached_property惰性构建：首次访问时创建一次，之后是普通
+    # 属性读取，热路径上没有任何初始化检查分支
+
+    @cached_property
+    def llm_client(self) -> LLMClient:
+        """LLM客户端（进程内只构建一次）"""
+        llm_config = self.plugin_config.get("llm_provider", {})
+        return LLMClient(llm_config)
+
+    @cached_property
+    def affection_service(self) -> AffectionService:
+        """好感度服务"""
+        return AffectionService(self.llm_client, self.plugin_config)
+
+    @cached_property
+    def weight_service(self) -> WeightService:
+        """权重评估服务"""
+        return WeightService(self.llm_client, self.plugin_config)
+
+    @cached_property
+    def text_impression_service(self) -> TextImpressionService:
+        """文本印象服务"""
+        return TextImpressionService(self.llm_client, self.plugin_config)
+
+    @cached_property
+    def message_service(self) -> MessageService:
+        """消息管理服务"""
+        return MessageService(self.plugin_config)
 
     async def execute(self, message) -> tuple:
         """执行事件处理器"""
         try:
-            self._ensure_services_initialized()
             asyncio.create_task(self._async_update_impression(message))
             return True, True, "印象和好感度更新任务已启动", None, None
         except Exception as e:
@@ -77,41 +114,13 @@ class ImpressionUpdateHandler(BaseEventHandler):
     async def _async_update_impression(self, event_data):
         """异步更新印象和好感度"""
         try:
-            self._ensure_services_initialized()
             result = await self.handle(event_data)
         except Exception as e:
             logger.error(f"印象更新失败: {str(e)}")
 
-    def _ensure_services_initialized(self):
-        """确保服务已初始化"""
-        if self._services_initialized:
-            return
-        self._init_services()
-        self._services_initialized = True
-
-    def _init_services(self):
-        """初始化服务"""
-        if not self.llm_client:
-            llm_config = self.plugin_config.get("llm_provider", {})
-            self.llm_client = LLMClient(llm_config)
-
-        if not self.affection_service:
-            self.affection_service = AffectionService(self.llm_client, self.plugin_config)
-
-        if not self.weight_service:
-            self.weight_service = WeightService(self.llm_client, self.plugin_config)
-
-        if not self.text_impression_service:
-            self.text_impression_service = TextImpressionService(self.llm_client, self.plugin_config)
-
-        if not self.message_service:
-            self.message_service = MessageService(self.plugin_config)
-
     async def handle(self, event_data) -> CustomEventHandlerResult:
         """处理事件：更新印象和好感度"""
         try:
-            self._ensure_services_initialized()
-
             user_id = ""
             message = None
 
@@ -167,6 +176,10 @@ class ImpressionUpdateHandler(BaseEventHandler):
             if not user_id:
                 return CustomEventHandlerResult(message="用户ID为空")
 
+            # 入口处intern：同一用户的ID在缓存、去重集合等字典里反复
+            # 作键，intern后查找可走指针相等短路
+            user_id = sys.intern(str(user_id))
+
             message_content = self._extract_message_content(message)
             if not message_content:
                 return CustomEventHandlerResult(message="消息内容为空")
@@ -182,17 +195,15 @@ class ImpressionUpdateHandler(BaseEventHandler):
                     message_timestamp = float(message.message_base_info['timestamp'])
 
             if not message_timestamp:
-                import time
                 message_timestamp = time.time()
 
             # 尝试从主程序数据库获取真实 message_id
             if self.weight_service.db_service and self.weight_service.db_service.is_connected():
                 message_id = self.weight_service.db_service.get_main_message_id(user_id, message_timestamp)
 
-            # 如果获取失败，生成临时ID
+            # 如果获取失败，生成临时ID（单调计数保证进程内唯一）
             if not message_id:
-                import time
-                message_id = f"temp_{user_id}_{int(message_timestamp)}"
+                message_id = f"temp_{user_id}_{_MID_BASE + next(_MID_COUNTER):x}"
 
             # 检查消息是否已处理
             is_processed = self.message_service.is_message_processed(user_id, message_id)
@@ -207,25 +218,31 @@ class ImpressionUpdateHandler(BaseEventHandler):
             max_messages = history_config.get("max_messages", 20)
             history_context, message_ids_in_context = self.weight_service.get_filtered_messages(user_id, limit=max_messages)
 
-            # 记录上下文中的消息为已处理（避免重复处理历史消息）
-            for msg_id in message_ids_in_context:
-                self.message_service.record_processed_message(user_id, msg_id)
+            # 上下文中的消息待标记为已处理（避免重复处理历史消息）
+            # 收集后在处理结束时单事务批量落库，而非每条一次提交
+            pending_processed = list(message_ids_in_context)
 
             # 权重评估
             weight_success = False
             weight_score = 0.0
             weight_level = "low"
+            trivial_message = False
 
-            if len(history_context.strip()) > 0:
+            # 过短或纯表情/标点的消息必然低权重，直接短路省掉一次LLM往返
+            if len(message_content) <= 4 or _TRIVIAL_MESSAGE_RE.match(message_content):
+                trivial_message = True
+                logger.debug(f"消息过短或无实质内容，跳过权重评估: {message_content[:20]}")
+            elif len(history_context.strip()) > 0:
                 weight_success, weight_score, weight_level = await self.weight_service.evaluate_message(
                     user_id, message_id, message_content, history_context
                 )
 
-            # 根据权重决定是否更新印象
+            # 根据权重决定是否更新印象；无实质内容的消息无论筛选模式
+            # 如何都不触发印象构建
             impression_updated = False
             should_update_impression = False
 
-            if weight_success:
+            if weight_success and not trivial_message:
                 filter_mode = self.weight_service.filter_mode
                 high_threshold = self.weight_service.high_threshold
                 medium_threshold = self.weight_service.medium_threshold
@@ -237,30 +254,55 @@ class ImpressionUpdateHandler(BaseEventHandler):
                 elif filter_mode == "balanced":
                     should_update_impression = weight_score >= medium_threshold
 
-            # 更新印象
-            if should_update_impression:
-                try:
-                    latest_context, latest_message_ids = self.weight_service.get_filtered_messages(user_id, limit=max_messages)
-                    success, impression_result = await self.text_impression_service.build_impression(
-                        user_id, message_content, latest_context
-                    )
-                    if success:
-                        impression_updated = True
-                        logger.info(f"印象更新成功: 用户 {user_id}")
-                except Exception as e:
-                    logger.error(f"印象更新异常: {str(e)}")
+            # 印象更新与好感度更新的LLM调用相互独立，并行执行；
+            # 两者只做计算，结果合并为对user_impressions的一次行写入
+            async def _build_impression_task():
+                if not should_update_impression:
+                    return False, "权重未达阈值，跳过印象更新"
+                latest_context, latest_message_ids = self.weight_service.get_filtered_messages(user_id, limit=max_messages)
+                return await self.text_impression_service.prepare_impression(
+                    user_id, message_content, latest_context
+                )
 
-            # 更新好感度
+            impression_outcome, affection_outcome = await asyncio.gather(
+                _build_impression_task(),
+                self.affection_service.prepare_affection_update(user_id, message_content),
+                return_exceptions=True,
+            )
+
+            impression_text = None
+            if isinstance(impression_outcome, BaseException):
+                logger.error(f"印象更新异常: {str(impression_outcome)}")
+            else:
+                success, impression_result = impression_outcome
+                if success:
+                    impression_text = impression_result
+
+            affection_fields = None
             affection_updated = False
-            try:
-                success, affection_result = await self.affection_service.update_affection(
-                    user_id, message_content
-                )
+            if isinstance(affection_outcome, BaseException):
+                logger.error(f"好感度更新异常: {str(affection_outcome)}")
+            else:
+                success, fields, affection_result = affection_outcome
                 if success:
-                    affection_updated = True
-                    logger.info(f"好感度更新成功: {affection_result}")
-            except Exception as e:
-                logger.error(f"好感度更新异常: {str(e)}")
+                    affection_fields = fields
+
+            # 融合落库：印象+好感度一次UPSERT
+            if impression_text is not None or affection_fields:
+                committed = self.message_service.commit_user_update(
+                    user_id, impression_text, affection_fields
+                )
+                if committed:
+                    if impression_text is not None:
+                        impression_updated = True
+                        logger.info(f"印象更新成功: 用户 {user_id}")
+                    if affection_fields:
+                        affection_updated = True
+                        logger.info(f"好感度更新成功: {affection_result}")
+
+            # 批量落库上下文消息的处理记录（单事务）
+            if pending_processed:
+                self.message_service.record_processed_messages(user_id, pending_processed)
 
             # 标记当前消息为已处理
             try:
@@ -274,8 +316,8 @@ class ImpressionUpdateHandler(BaseEventHandler):
             except Exception as e:
                 logger.error(f"记录消息处理状态失败: {str(e)}")
 
-            # 更新消息状态统计
-            self.message_service.update_message_state(
+            # 更新消息状态统计（内存累积，后台批量落库）
+            await self.message_service.queue_message_state_update(
                 user_id, message_id, impression_updated, affection_updated
             )
 
@@ -286,21 +328,29 @@ class ImpressionUpdateHandler(BaseEventHandler):
             logger.error(f"处理事件失败: {str(e)}")
             return CustomEventHandlerResult(message=f"异常: {str(e)}")
 
-    def _extract_message_content(self, message) -> str:
-        """提取消息内容"""
-        message_content = ""
+    @staticmethod
+    def _extract_message_content(message) -> str:
+        """提取消息内容 - 每条消息都会经过，保持最少的属性访问和临时对象"""
+        plain_text = getattr(message, 'plain_text', None)
+        if plain_text:
+            text = plain_text if isinstance(plain_text, str) else str(plain_text)
+            return text.strip()
 
-        if hasattr(message, 'plain_text') and message.plain_text:
-            message_content = str(message.plain_text)
-        elif hasattr(message, 'message_segments') and message.message_segments:
-            message_content = " ".join([
-                str(seg.data) for seg in message.message_segments
-                if hasattr(seg, 'data')
-            ])
-        elif hasattr(message, 'content') and message.content:
-            message_content = str(message.content)
+        segments = getattr(message, 'message_segments', None)
+        if segments:
+            parts = []
+            for seg in segments:
+                data = getattr(seg, 'data', None)
+                if data is not None:
+                    parts.append(data if isinstance(data, str) else str(data))
+            return " ".join(parts).strip()
 
-        return message_content.strip()
+        content = getattr(message, 'content', None)
+        if content:
+            text = content if isinstance(content, str) else str(content)
+            return text.strip()
+
+        return ""
 
 
 @register_plugin
@@ -597,7 +647,7 @@ class ImpressionAffectionPlugin(BasePlugin):
         """初始化数据库"""
         if not self.db_initialized:
             try:
-                db.connect()
+                db.connect(reuse_if_open=True)
 
                 from .models import (
                     UserImpression,
@@ -650,12 +700,29 @@ class ImpressionAffectionPlugin(BasePlugin):
             else:
                 logger.debug("difficulty_level 字段已存在，跳过迁移")
 
+            # 为 UserImpression 添加 impression_summary_cached 字段
+            if 'impression_summary_cached' not in columns:
+                logger.info("检测到缺少 impression_summary_cached 字段，开始数据库迁移...")
+                db.execute_sql("ALTER TABLE user_impressions ADD COLUMN impression_summary_cached TEXT DEFAULT ''")
+                logger.info("数据库迁移完成：已添加 impression_summary_cached 字段")
+            else:
+                logger.debug("impression_summary_cached 字段已存在，跳过迁移")
+
+            # 为按更新时间排序的查询补充降序索引（复合索引(user_id, updated_at)无法覆盖）
+            db.execute_sql("CREATE INDEX IF NOT EXISTS idx_ui_updated ON user_impressions(updated_at DESC)")
+
         except Exception as e:
             logger.error(f"数据库迁移失败: {str(e)}")
             # 不抛出异常，允许插件继续运行，但记录错误
 
     def get_plugin_components(self) -> List[Tuple[ComponentInfo, Type]]:
-        """返回插件组件列表"""
+        """返回插件组件列表（结果缓存在实例上，框架重复调用时直接复用）"""
+        # 组件信息与配置在进程内不变，get_*_info()的类方法调度和
+        # 数据库初始化只需要做一次
+        cached = getattr(self, '_components_cache', None)
+        if cached is not None:
+            return cached
+
         self.init_db()
         components = []
 
@@ -679,4 +746,5 @@ class ImpressionAffectionPlugin(BasePlugin):
                 (ListImpressionsCommand.get_command_info(), ListImpressionsCommand)
             ])
 
+        self._components_cache = components
         return components
@@ -4,13 +4,15 @@
 
 import json
 import re
-from typing import Dict, Any, Tuple
+from typing import Dict, Any, Tuple, Optional
 from datetime import datetime
 
 from ..models import UserImpression
 from ..clients import LLMClient
 from src.common.logger import get_logger
 from ..utils.constants import AFFECTION_LEVELS, DIFFICULTY_LEVELS, AFFECTION_INCREMENTS
+from ..utils.llm_cache import llm_result_cache
+from ..utils.prompt_template import PrecompiledTemplate
 
 
 class AffectionService:
@@ -23,6 +25,10 @@ class AffectionService:
 
         # 从配置文件加载各模块配置
         self.prompts_config = config.get("prompts", {})
+
+        # 配置模板初始化时预拆分一次，渲染只做拼接
+        template = self.prompts_config.get("affection_template", "").strip()
+        self._affection_template = PrecompiledTemplate(template) if template else None
         self.increment_config = config.get("affection_increment", {})
         self.affection_config = config.get("affection", {})
         self.difficulty_config = config.get("difficulty", {})
@@ -47,8 +53,7 @@ class AffectionService:
 
     async def update_affection(self, user_id: str, message: str) -> Tuple[bool, str]:
         """
-        更新用户好感度 - 增强版本，支持难度系统和固定好感度
-        修复：Nightmare 模式增加双重验证，防止负面消息被误判为加分
+        更新用户好感度（计算并立即落库）
 
         Args:
             user_id: 用户ID
@@ -57,28 +62,43 @@ class AffectionService:
         Returns:
             (是否成功, 结果描述)
         """
+        success, fields, result = await self.prepare_affection_update(user_id, message)
+        if not success or fields is None:
+            return success, result
+
+        # 复用融合写入路径落库（单条UPSERT）
+        from .message_service import MessageService
+        if not MessageService.commit_user_update(user_id, affection_fields=fields):
+            return False, "好感度保存失败"
+
+        return True, result
+
+    async def prepare_affection_update(self, user_id: str, message: str) -> Tuple[bool, Optional[Dict[str, Any]], str]:
+        """
+        计算好感度更新但不落库 - 增强版本，支持难度系统和固定好感度
+        修复：Nightmare 模式增加双重验证，防止负面消息被误判为加分
+
+        结果字段交由MessageService.commit_user_update与印象更新
+        合并为一次行写入。
+
+        Args:
+            user_id: 用户ID
+            message: 消息内容
+
+        Returns:
+            (是否成功, 待写入字段, 结果描述)
+        """
         try:
             # 检查是否是固定好感度用户（固定好感度不会被聊天改变）
             if user_id in self.fixed_affection:
                 fixed_score = float(self.fixed_affection[user_id])
-
-                # 获取或创建记录
-                impression, created = UserImpression.get_or_create(
-                    user_id=user_id,
-                    defaults={
-                        "affection_score": fixed_score,
-                        "affection_level": self._get_affection_level(fixed_score),
-                        "difficulty_level": self.default_difficulty
-                    }
-                )
-
-                # 如果不是新建的，强制更新为固定值（防止被修改）
-                if not created:
-                    impression.affection_score = fixed_score
-                    impression.affection_level = self._get_affection_level(fixed_score)
-                    impression.save()
-
-                return True, f"固定好感度用户 {user_id}: {fixed_score}分（不会被聊天改变）"
+                fields = {
+                    "affection_score": fixed_score,
+                    "affection_level": self._get_affection_level(fixed_score),
+                    "difficulty_level": self.default_difficulty,
+                    "message_count_delta": 0,
+                }
+                return True, fields, f"固定好感度用户 {user_id}: {fixed_score}分（不会被聊天改变）"
 
             # 普通用户：使用配置的初始值创建
             impression, created = UserImpression.get_or_create(
@@ -157,27 +177,33 @@ class AffectionService:
             # 确保分数在 0-100 范围内
             new_score = old_score + increment
             new_score = max(0, min(100, new_score))
+            new_level = self._get_affection_level(new_score)
 
-            # 保存更新
-            impression.affection_score = new_score
-            impression.affection_level = self._get_affection_level(new_score)
-            impression.message_count += 1
-            impression.update_timestamps()
-            impression.save()
+            fields = {
+                "affection_score": new_score,
+                "affection_level": new_level,
+                "message_count_delta": 1,
+            }
 
             # 构建结果消息
             result = f"{reason}\n({old_score:.1f} -> {new_score:.1f})\n"
-            result += f"当前好感度: {impression.affection_level} ({new_score:.1f}/100)\n"
+            result += f"当前好感度: {new_level} ({new_score:.1f}/100)\n"
             result += f"难度: {difficulty_config['name']}"
 
-            return True, result
+            return True, fields, result
 
         except Exception as e:
             self.logger.error(f"更新好感度失败: {str(e)}")
-            return False, f"更新好感度失败: {str(e)}"
+            return False, None, f"更新好感度失败: {str(e)}"
 
     async def _evaluate_comment_type(self, message: str) -> Tuple[str, str]:
         """评估评论类型（基础情感分析）"""
+        # 好感度提示词只依赖消息本身，相同消息的评估结果直接复用
+        cache_key = llm_result_cache.make_key("affection", message)
+        cached = llm_result_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         prompt = self._build_affection_prompt(message)
 
         success, content = await self.llm_client.generate_affection_analysis(prompt)
@@ -191,7 +217,9 @@ class AffectionService:
         if not result:
             return "neutral", "解析失败，默认为中性"
 
-        return result.get("type", "neutral"), result.get("reason", "")
+        outcome = (result.get("type", "neutral"), result.get("reason", ""))
+        llm_result_cache.put(cache_key, outcome)
+        return outcome
 
     async def _evaluate_nightmare_mode(self, message: str) -> Tuple[str, str]:
         """
@@ -270,10 +298,8 @@ VERDICT: strong_agreement/normal/minor_disagreement/disagreement;REASON: 简要
 
     def _build_affection_prompt(self, message: str) -> str:
         """构建好感度评估提示词"""
-        template = self.prompts_config.get("affection_template", "").strip()
-
-        if template:
-            return template.format(message=message, context="")
+        if self._affection_template is not None:
+            return self._affection_template.render({'message': message, 'context': ""})
 
         # 默认提示词
         return f"""你是一个情感分析师。请评估用户消息的情感倾向。
@@ -3,15 +3,132 @@
 """
 
 import os
+import sys
 import hashlib
+import asyncio
+from collections import OrderedDict
 from typing import Dict, Any, Optional, Set, List
 from datetime import datetime, timedelta
 
-from ..models import UserMessageState, ImpressionMessageRecord, UserImpression
+from peewee import chunked
+
+from ..models import db, UserMessageState, ImpressionMessageRecord, UserImpression
 from src.common.logger import get_logger
 
 logger = get_logger("impression_affection_message")
 
+
+class CounterAggregator:
+    """消息状态计数聚合器
+
+    把每条消息一次的UserMessageState行写入改为内存累积增量，由后台
+    任务定期批量落库：O(消息数)次fsync变成O(刷新次数)次。进程内共享
+    一个实例即可（见模块级_counter_aggregator）。
+    """
+
+    FLUSH_INTERVAL = 0.5  # 秒
+
+    def __init__(self):
+        self._deltas: Dict[str, Dict[str, Any]] = {}
+        self._lock: Optional[asyncio.Lock] = None
+        self._flusher: Optional[asyncio.Task] = None
+
+    async def add(self, user_id: str, message_id: str,
+                  impression_updated: bool = False, affection_updated: bool = False):
+        """累积一条消息的计数增量（内存操作，不触发数据库写入）"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        self._ensure_flusher()
+
+        async with self._lock:
+            delta = self._deltas.setdefault(user_id, {
+                "total": 0,
+                "impression": 0,
+                "affection": 0,
+                "last_message_id": None,
+            })
+            delta["total"] += 1
+            if impression_updated:
+                delta["impression"] += 1
+            if affection_updated:
+                delta["affection"] += 1
+            delta["last_message_id"] = message_id
+
+    def _ensure_flusher(self):
+        """惰性启动后台刷新任务（需在事件循环内调用）"""
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._run())
+
+    async def _run(self):
+        """后台循环：定期把累积的增量批量写入数据库"""
+        while True:
+            await asyncio.sleep(self.FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"批量刷新消息状态失败: {str(e)}")
+
+    async def flush(self):
+        """立即刷新当前累积的所有增量"""
+        if self._lock is None:
+            return
+
+        async with self._lock:
+            if not self._deltas:
+                return
+            batch, self._deltas = self._deltas, {}
+
+        await asyncio.to_thread(self._flush_sync, batch)
+
+    @staticmethod
+    def _flush_sync(batch: Dict[str, Dict[str, Any]]):
+        """单事务内把一批用户的计数增量写入数据库
+
+        在asyncio.to_thread的工作线程里执行：连接池连接按线程归属，
+        结束时显式归还，避免执行器线程永久占用池槽位。
+        """
+        now = datetime.now()
+        try:
+            with db.atomic():
+                for user_id, delta in batch.items():
+                    UserMessageState.get_or_create(user_id=user_id)
+                    UserMessageState.update(
+                        total_messages=UserMessageState.total_messages + delta["total"],
+                        processed_messages=UserMessageState.processed_messages + delta["total"],
+                        impression_update_count=UserMessageState.impression_update_count + delta["impression"],
+                        affection_update_count=UserMessageState.affection_update_count + delta["affection"],
+                        last_message_id=delta["last_message_id"],
+                        last_message_time=now,
+                    ).where(UserMessageState.user_id == user_id).execute()
+        finally:
+            db.close()
+
+
+# 进程内共享的计数聚合器
+_counter_aggregator = CounterAggregator()
+
+# 已处理消息键的进程内LRU集合 - 命中时免去每条消息一次的SELECT
+# 键格式 "user_id:message_id"；模块级共享，MessageService实例是临时创建的
+_seen_message_keys: "OrderedDict[Tuple[str, str], None]" = OrderedDict()
+_SEEN_KEYS_MAXSIZE = 50000
+
+
+def _seen_contains(key: "Tuple[str, str]") -> bool:
+    """检查键是否在LRU集合中，命中时刷新其顺序"""
+    if key in _seen_message_keys:
+        _seen_message_keys.move_to_end(key)
+        return True
+    return False
+
+
+def _seen_add(key: "Tuple[str, str]"):
+    """把键加入LRU集合，超出容量时淘汰最久未访问的键"""
+    _seen_message_keys[key] = None
+    _seen_message_keys.move_to_end(key)
+    if len(_seen_message_keys) > _SEEN_KEYS_MAXSIZE:
+        _seen_message_keys.popitem(last=False)
+
+
 class MessageService:
     """消息管理服务"""
 
@@ -47,7 +164,8 @@ class MessageService:
         # 移除花括号等
         user_id_str = user_id_str.strip("{}[]()")
 
-        return user_id_str
+        # intern后作为字典/集合键时可走指针相等短路
+        return sys.intern(user_id_str)
 
     def generate_content_hash(self, content: str) -> str:
         """
@@ -79,6 +197,12 @@ class MessageService:
 
         normalized_user_id = self.normalize_user_id(user_id)
 
+        # 先查内存LRU集合，命中时跳过数据库查询
+        seen_key = (normalized_user_id, message_id)
+        if _seen_contains(seen_key):
+            logger.debug(f"消息已处理(内存): 用户 {normalized_user_id}, message_id {message_id}")
+            return True
+
         # 检查数据库记录
         try:
             existing = ImpressionMessageRecord.select().where(
@@ -87,6 +211,7 @@ class MessageService:
             ).first()
 
             if existing:
+                _seen_add(seen_key)
                 logger.debug(f"消息已处理(数据库): 用户 {normalized_user_id}, message_id {message_id}")
                 return True
             else:
@@ -130,6 +255,8 @@ class MessageService:
             else:
                 logger.debug(f"消息已存在: 用户 {normalized_user_id}, message_id {message_id}")
 
+            _seen_add((normalized_user_id, message_id))
+
         except Exception as e:
             logger.error(f"记录处理消息失败: {str(e)}")
 
@@ -194,6 +321,76 @@ class MessageService:
             logger.error(f"获取已处理消息ID失败: {str(e)}")
             return set()
 
+    def flush_batch(self, items: List) -> int:
+        """
+        批量记录已处理消息 - 单事务写入
+
+        把一次事件处理中产生的多条(user_id, message_id)记录合并为一条
+        insert_many语句提交，替代每条消息一次SELECT+INSERT+commit。
+
+        Args:
+            items: (user_id, message_id)元组列表
+
+        Returns:
+            实际插入的记录数
+        """
+        if not items:
+            return 0
+
+        now = datetime.now()
+        rows = []
+        seen = set()
+        for user_id, message_id in items:
+            if not message_id:
+                continue
+            normalized_user_id = self.normalize_user_id(user_id)
+            key = (normalized_user_id, message_id)
+            if key in seen:
+                continue
+            seen.add(key)
+            rows.append({
+                "user_id": normalized_user_id,
+                "message_id": message_id,
+                "processed_at": now,
+            })
+
+        if not rows:
+            return 0
+
+        try:
+            inserted = 0
+            with db.atomic():
+                # message_id唯一索引 + on_conflict_ignore 负责数据库侧去重；
+                # 每批300行(900个绑定变量)，避开SQLite默认999变量上限。
+                # as_rowcount让execute返回受影响行数而不是lastrowid
+                for batch in chunked(rows, 300):
+                    inserted += ImpressionMessageRecord.insert_many(batch).on_conflict_ignore().as_rowcount().execute() or 0
+
+            for row in rows:
+                _seen_add((row['user_id'], row['message_id']))
+
+            logger.debug(f"批量记录处理消息: 提交 {len(rows)} 条")
+            return inserted or 0
+        except Exception as e:
+            logger.error(f"批量记录处理消息失败: {str(e)}")
+            return 0
+
+    def record_processed_messages(self, user_id: str, message_ids: List[str]) -> int:
+        """
+        批量记录同一用户的多条已处理消息
+
+        record_processed_message的批量形式：去重、分批插入都在
+        flush_batch的单个事务里完成，替代逐条的SELECT+INSERT。
+
+        Args:
+            user_id: 用户ID
+            message_ids: 消息ID列表
+
+        Returns:
+            实际插入的记录数
+        """
+        return self.flush_batch([(user_id, message_id) for message_id in message_ids])
+
     def cleanup_old_records(self, user_id: str, days_to_keep: int = 30):
         """
         清理旧的处理记录
@@ -219,6 +416,83 @@ class MessageService:
         except Exception as e:
             logger.error(f"清理旧记录失败: {str(e)}")
 
+    @staticmethod
+    def commit_user_update(user_id: str, impression_text: Optional[str] = None,
+                           affection_fields: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        融合提交印象与好感度 - 单条UPSERT写入user_impressions
+
+        印象文本与好感度结果由两路LLM并行产出，原先各自写一次同一行，
+        这里合并为一次写入，减半写放大并省掉WAL模式下的第二次fsync。
+
+        Args:
+            user_id: 用户ID
+            impression_text: 清理后的印象文本，None表示本次不更新印象
+            affection_fields: 好感度字段（affection_score/affection_level/
+                message_count_delta/可选difficulty_level），None表示不更新
+
+        Returns:
+            是否写入成功
+        """
+        if impression_text is None and not affection_fields:
+            return False
+
+        now = datetime.now()
+        insert_row = {"user_id": user_id, "updated_at": now}
+        update_row = {UserImpression.updated_at: now}
+
+        if impression_text is not None:
+            insert_row["personality_traits"] = impression_text
+            update_row.update({
+                # DO UPDATE中对列的引用取的是冲突行的旧值，版本链保持完整
+                UserImpression.previous_impression: UserImpression.personality_traits,
+                UserImpression.personality_traits: impression_text,
+                UserImpression.impression_version: UserImpression.impression_version + 1,
+                UserImpression.impression_update_count: UserImpression.impression_update_count + 1,
+                # 摘要缓存依赖本语句未读取的维度字段，置空让读取端实时拼接
+                UserImpression.impression_summary_cached: "",
+            })
+
+        if affection_fields:
+            message_count_delta = affection_fields.get("message_count_delta", 0)
+            insert_row["affection_score"] = affection_fields["affection_score"]
+            insert_row["affection_level"] = affection_fields["affection_level"]
+            insert_row["message_count"] = message_count_delta
+            if "difficulty_level" in affection_fields:
+                insert_row["difficulty_level"] = affection_fields["difficulty_level"]
+            update_row[UserImpression.affection_score] = affection_fields["affection_score"]
+            update_row[UserImpression.affection_level] = affection_fields["affection_level"]
+            if message_count_delta:
+                update_row[UserImpression.message_count] = UserImpression.message_count + message_count_delta
+
+        try:
+            with db.atomic():
+                (UserImpression
+                 .insert(**insert_row)
+                 .on_conflict(conflict_target=[UserImpression.user_id], update=update_row)
+                 .execute())
+
+            # 失效工具层与印象服务的读取缓存，确保后续读取到最新数据
+            from ..components.tools import invalidate_impression_cache
+            from .text_impression_service import invalidate_impression_instance
+            invalidate_impression_cache(user_id)
+            invalidate_impression_instance(user_id)
+
+            return True
+        except Exception as e:
+            logger.error("合并提交用户更新失败: %s", e)
+            return False
+
+    async def queue_message_state_update(self, user_id: str, message_id: str,
+                                         impression_updated: bool = False, affection_updated: bool = False):
+        """
+        异步累积用户消息状态更新 - 经聚合器批量落库
+
+        与update_message_state语义一致，但只做内存累加，由后台任务
+        合并多条消息的计数后一次性写入，适合事件处理的热路径。
+        """
+        await _counter_aggregator.add(user_id, message_id, impression_updated, affection_updated)
+
     def update_message_state(self, user_id: str, message_id: str, impression_updated: bool = False, affection_updated: bool = False):
         """
         更新用户消息状态
@@ -230,24 +504,38 @@ class MessageService:
             affection_updated: 是否更新了好感度
         """
         try:
-            state, created = UserMessageState.get_or_create(user_id=user_id)
-
-            state.last_message_id = message_id
-            state.last_message_time = datetime.now()
-            state.total_messages += 1
-            state.processed_messages += 1
-
-            if impression_updated:
-                state.impression_update_count += 1
-
-            if affection_updated:
-                state.affection_update_count += 1
-
-            state.save()
+            now = datetime.now()
+            impression_delta = 1 if impression_updated else 0
+            affection_delta = 1 if affection_updated else 0
+
+            # 单条UPSERT代替get_or_create+save，一次SQL往返完成插入或累加
+            (UserMessageState
+             .insert(
+                 user_id=user_id,
+                 last_message_id=message_id,
+                 last_message_time=now,
+                 total_messages=1,
+                 processed_messages=1,
+                 impression_update_count=impression_delta,
+                 affection_update_count=affection_delta,
+             )
+             .on_conflict(
+                 conflict_target=[UserMessageState.user_id],
+                 update={
+                     UserMessageState.last_message_id: message_id,
+                     UserMessageState.last_message_time: now,
+                     UserMessageState.total_messages: UserMessageState.total_messages + 1,
+                     UserMessageState.processed_messages: UserMessageState.processed_messages + 1,
+                     UserMessageState.impression_update_count: UserMessageState.impression_update_count + impression_delta,
+                     UserMessageState.affection_update_count: UserMessageState.affection_update_count + affection_delta,
+                 },
+             )
+             .execute())
 
         except Exception as e:
-            # 记录错误但不抛出，避免影响主流程
-            print(f"更新消息状态失败: {str(e)}")
+            # 记录错误但不抛出，避免影响主流程；%s延迟格式化，
+            # 日志级别被过滤时不构造字符串
+            logger.error("更新消息状态失败: %s", e)
 
     def record_processed_message(self, user_id: str, message_id: str, content: str = None, impression_id: str = None) -> bool:
         """
@@ -287,6 +575,7 @@ class MessageService:
                     existing.content_hash = content_hash
                     existing.save()
                     logger.debug(f"更新消息内容哈希: 用户 {normalized_user_id}, 消息ID {message_id}, 哈希 {content_hash[:8]}...")
+                _seen_add((normalized_user_id, message_id))
                 return False
 
             # 创建记录
@@ -297,6 +586,7 @@ class MessageService:
                 content_hash=content_hash,
                 processed_at=datetime.now()
             )
+            _seen_add((normalized_user_id, message_id))
 
             # 添加到内存缓存
             if content_hash:
@@ -4,16 +4,102 @@
 
 from typing import Dict, Any, Tuple, Optional, List
 from datetime import datetime
+import asyncio
+import json
+import time
 import re
 
 from ..models import UserImpression
 from ..clients import LLMClient
 from ..utils.constants import AFFECTION_LEVELS
+from ..utils.llm_cache import llm_result_cache
+from ..utils.prompt_template import PrecompiledTemplate
 from .database_service import DatabaseService
 from src.common.logger import get_logger
 
 logger = get_logger("impression_affection_text")
 
+# 印象响应解析/清理用的正则，导入时编译一次，避免每条响应重复编译
+_LABEL_PREFIX_RE = re.compile(r'^(印象描述|印象|描述)[:：]\s*', re.IGNORECASE)
+_QUOTES_RE = re.compile(r'["""]')
+_WHITESPACE_RE = re.compile(r'\s+')
+_ENGLISH_WORD_RE = re.compile(r'\b[a-zA-Z]+\b')
+_REPEAT_COMMA_RE = re.compile(r'[，,]{2,}')
+_REPEAT_PERIOD_RE = re.compile(r'[。.]{2,}')
+
+# 每用户UserImpression ORM实例的读穿缓存：一次会话中工具调用会对
+# 同一用户反复SELECT，短窗口内直接复用实例；任何写入路径都应失效
+_ORM_CACHE: Dict[str, Tuple[float, UserImpression]] = {}
+_ORM_CACHE_TTL = 60.0
+_ORM_CACHE_MAXSIZE = 1000
+
+
+def invalidate_impression_instance(user_id: str = None):
+    """失效ORM实例缓存；user_id为None时清空全部"""
+    if user_id is None:
+        _ORM_CACHE.clear()
+    else:
+        _ORM_CACHE.pop(user_id, None)
+
+
+class PromptBatcher:
+    """印象分析提示词微批器
+
+    在一个很短的聚合窗口内收集并发提交的提示词，合并为一次LLM批量
+    请求发出，摊薄每次请求的往返和prefill开销；窗口内只有一条时退化
+    为普通单次调用，不增加额外延迟。
+    """
+
+    # 聚合窗口（秒）与单批上限
+    WINDOW_SECONDS = 0.05
+    POLL_INTERVAL = 0.005
+
+    def __init__(self, llm_client: LLMClient):
+        self.llm_client = llm_client
+        self.max_batch = LLMClient.IMPRESSION_BATCH_LIMIT
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._worker: Optional[asyncio.Task] = None
+
+    async def submit(self, prompt: str) -> Tuple[bool, str]:
+        """提交一条提示词，等待其在某个批次中完成"""
+        self._ensure_worker()
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((prompt, future))
+        return await future
+
+    def _ensure_worker(self):
+        """惰性启动后台聚合任务（需在事件循环内调用）"""
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def _run(self):
+        """后台循环：攒批 -> 发送 -> 按序分发结果"""
+        while True:
+            batch = [await self._queue.get()]
+
+            # 在窗口内继续收集，直到凑满一批或超时
+            deadline = time.monotonic() + self.WINDOW_SECONDS
+            while len(batch) < self.max_batch and time.monotonic() < deadline:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    await asyncio.sleep(self.POLL_INTERVAL)
+
+            prompts = [prompt for prompt, _ in batch]
+
+            try:
+                if len(prompts) == 1:
+                    results = [await self.llm_client.generate_impression_analysis(prompts[0])]
+                else:
+                    results = await self.llm_client.generate_impression_analysis_batch(prompts)
+            except Exception as e:
+                results = [(False, f"批量调用失败: {str(e)}")] * len(prompts)
+
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
 
 class TextImpressionService:
     """文本印象服务 - 基于LLM分析用户消息并更新多维度印象"""
@@ -23,19 +109,55 @@ class TextImpressionService:
         self.config = config
         self.prompts_config = config.get("prompts", {})
         self.db_service = DatabaseService(config)
+        # 印象分析请求经过微批器聚合后再发往LLM
+        self.prompt_batcher = PromptBatcher(llm_client)
+
+        # 模板和长度限制在进程内不变，初始化时预拆分/预读一次，
+        # 热路径上不再重复解析format字段
+        template = self.prompts_config.get("impression_template", "").strip()
+        self._impression_template = PrecompiledTemplate(template) if template else None
+        self.max_history_chars = self.prompts_config.get("max_history_chars", 2000)
+        self.max_message_chars = self.prompts_config.get("max_message_chars", 500)
 
     async def build_impression(self, user_id: str, message: str, history_context: str = "") -> Tuple[bool, str]:
         """
-        构建用户印象 - 基于LLM分析的多维度印象
-        
+        构建并保存用户印象 - 基于LLM分析的多维度印象
+
         Args:
             user_id: 用户ID
             message: 当前消息
             history_context: 历史上下文
-            
+
         Returns:
             (是否成功, 印象描述)
         """
+        success, cleaned_impression = await self.prepare_impression(user_id, message, history_context)
+        if not success:
+            return False, cleaned_impression
+
+        # 保存印象（使用更新方式）
+        if self._save_impression_update(user_id, cleaned_impression):
+            logger.debug(f"印象更新成功")
+            return True, cleaned_impression
+
+        logger.warning(f"印象保存失败")
+        return False, "印象保存失败"
+
+    async def prepare_impression(self, user_id: str, message: str, history_context: str = "") -> Tuple[bool, str]:
+        """
+        生成清理后的印象文本但不落库
+
+        落库交由MessageService.commit_user_update与好感度更新合并为
+        一次行写入。
+
+        Args:
+            user_id: 用户ID
+            message: 当前消息
+            history_context: 历史上下文
+
+        Returns:
+            (是否成功, 印象文本或错误描述)
+        """
         try:
             # 获取用户现有印象
             existing_impression = self._get_existing_impression(user_id)
@@ -46,30 +168,28 @@ class TextImpressionService:
             # 生成更新提示词
             prompt = self._build_update_prompt(existing_impression, enhanced_context, message)
             
-            # 调用LLM生成印象
-            success, content = await self.llm_client.generate_impression_analysis(prompt)
+            # 相同消息+上下文的分析结果直接复用，跳过LLM往返
+            cache_key = llm_result_cache.make_key("impression", message, enhanced_context)
+            cleaned_impression = llm_result_cache.get(cache_key)
 
-            if not success:
-                return False, f"LLM调用失败: {content}"
+            if cleaned_impression is None:
+                # 调用LLM生成印象（经微批器聚合并发请求）
+                success, content = await self.prompt_batcher.submit(prompt)
 
-            # 解析响应
-            impression_result = self._parse_impression_response(content)
-            
-            if impression_result:
-                # 清理印象结果，确保纯中文输出
-                cleaned_impression = self._clean_impression_text(impression_result)
-                
-                # 保存印象（使用更新方式）
-                success = self._save_impression_update(user_id, cleaned_impression)
-                if success:
-                    logger.debug(f"印象更新成功")
-                    return True, cleaned_impression
-                else:
-                    logger.warning(f"印象保存失败")
-                    return False, "印象保存失败"
-            else:
-                logger.warning(f"印象解析失败: {content}")
-                return False, "印象解析失败"
+                if not success:
+                    return False, f"LLM调用失败: {content}"
+
+                # 解析+清理走线程池：长响应上的多次正则是纯CPU工作，
+                # 放到工作线程避免阻塞事件循环里的其它消息处理
+                cleaned_impression = await asyncio.to_thread(self._parse_and_clean_response, content)
+
+                if not cleaned_impression:
+                    logger.warning(f"印象解析失败: {content}")
+                    return False, "印象解析失败"
+
+                llm_result_cache.put(cache_key, cleaned_impression)
+
+            return True, cleaned_impression
 
         except Exception as e:
             return False, f"构建印象失败: {str(e)}"
@@ -159,25 +279,28 @@ class TextImpressionService:
 
     def _build_prompt(self, history_context: str, message: str) -> str:
         """构建印象分析提示词"""
-        template = self.prompts_config.get("impression_template", "").strip()
+        limited_history = history_context[:self.max_history_chars]
+        limited_message = message[:self.max_message_chars]
 
-        # 从配置获取长度限制
-        max_history_chars = self.config.get("prompts", {}).get("max_history_chars", 2000)
-        max_message_chars = self.config.get("prompts", {}).get("max_message_chars", 500)
-
-        if template:
-            return template.format(
-                history_context=history_context[:max_history_chars],
-                message=message[:max_message_chars],
-                context=""
-            )
+        if self._impression_template is not None:
+            return self._impression_template.render({
+                'history_context': limited_history,
+                'message': limited_message,
+                'context': ""
+            })
 
         # 默认提示词 - 使用配置的长度限制
-        limited_history = history_context[:max_history_chars] if len(history_context) > max_history_chars else history_context
-        limited_message = message[:max_message_chars] if len(message) > max_message_chars else message
-        
         return f"请基于用户的聊天记录生成印象描述，用自然语言描述这个人的性格特点、兴趣爱好、交流方式等，长度50-100字。要求语言自然流畅，像朋友介绍这个人一样。如果信息不足，可以适当推测并用'似乎'、'看起来'等词。历史对话: {limited_history} 当前消息: {limited_message}"
 
+    def _parse_and_clean_response(self, content: str) -> Optional[str]:
+        """解析并清理印象响应（同步纯函数，供线程池调用）"""
+        impression_result = self._parse_impression_response(content)
+        if not impression_result:
+            return None
+
+        # 清理印象结果，确保纯中文输出
+        return self._clean_impression_text(impression_result)
+
     def _parse_impression_response(self, content: str) -> Optional[str]:
         """解析印象构建响应"""
         # 移除可能的JSON格式标记
@@ -186,7 +309,6 @@ class TextImpressionService:
         # 如果是JSON格式，提取内容
         if content.startswith('{') and content.endswith('}'):
             try:
-                import json
                 data = json.loads(content)
                 if 'impression' in data:
                     content = data['impression']
@@ -196,11 +318,11 @@ class TextImpressionService:
                 pass
         
         # 移除可能的标记
-        content = re.sub(r'^(印象描述|印象|描述)[:：]\s*', '', content, flags=re.IGNORECASE)
-        content = re.sub(r'["""]', '', content)
-        
+        content = _LABEL_PREFIX_RE.sub('', content)
+        content = _QUOTES_RE.sub('', content)
+
         # 清理多余空白
-        content = re.sub(r'\s+', ' ', content).strip()
+        content = _WHITESPACE_RE.sub(' ', content).strip()
         
         # 验证内容质量
         if len(content) < 10:
@@ -226,12 +348,12 @@ class TextImpressionService:
         
         # 移除英文单词和缩写
         # 匹配英文单词（包括likely、maybe等）
-        cleaned = re.sub(r'\b[a-zA-Z]+\b', '', impression)
-        
+        cleaned = _ENGLISH_WORD_RE.sub('', impression)
+
         # 移除多余的标点符号
-        cleaned = re.sub(r'[，,]{2,}', '，', cleaned)
-        cleaned = re.sub(r'[。.]{2,}', '。', cleaned)
-        cleaned = re.sub(r'\s+', '', cleaned)  # 移除所有空白
+        cleaned = _REPEAT_COMMA_RE.sub('，', cleaned)
+        cleaned = _REPEAT_PERIOD_RE.sub('。', cleaned)
+        cleaned = _WHITESPACE_RE.sub('', cleaned)  # 移除所有空白
         
         # 移除开头和结尾的标点
         cleaned = cleaned.strip('，。、；;！!？?')
@@ -258,21 +380,32 @@ class TextImpressionService:
             是否保存成功
         """
         try:
-            # 获取或创建用户印象记录
-            impression, created = UserImpression.get_or_create(
-                user_id=user_id,
-                defaults={
-                    'personality_traits': impression_text,
-                    'updated_at': datetime.now()
-                }
-            )
-            
-            if not created:
-                # 更新现有记录
-                impression.personality_traits = impression_text
-                impression.update_timestamps()
-                impression.save()
-            
+            now = datetime.now()
+
+            # 单条UPSERT代替get_or_create+save，消除读-改-写的两次往返；
+            # 摘要缓存在UPSERT里无法基于其它维度字段重算，置空让读取端
+            # 退回实时拼接，下次完整save()时会重新生成
+            (UserImpression
+             .insert(
+                 user_id=user_id,
+                 personality_traits=impression_text,
+                 updated_at=now,
+             )
+             .on_conflict(
+                 conflict_target=[UserImpression.user_id],
+                 update={
+                     UserImpression.personality_traits: impression_text,
+                     UserImpression.updated_at: now,
+                     UserImpression.impression_summary_cached: "",
+                 },
+             )
+             .execute())
+
+            # 失效工具层的印象查询缓存，确保后续读取到最新数据
+            from ..components.tools import invalidate_impression_cache
+            invalidate_impression_cache(user_id)
+            invalidate_impression_instance(user_id)
+
             logger.debug(f"印象已保存: 用户 {user_id}, 印象: {impression_text[:50]}...")
             return True
             
@@ -315,18 +448,15 @@ class TextImpressionService:
         Returns:
             增量更新提示词
         """
-        template = self.prompts_config.get("impression_template", "").strip()
-
-        # 从配置获取长度限制
-        max_history_chars = self.config.get("prompts", {}).get("max_history_chars", 2000)
-        max_message_chars = self.config.get("prompts", {}).get("max_message_chars", 500)
+        max_history_chars = self.max_history_chars
+        max_message_chars = self.max_message_chars
 
-        if template:
-            return template.format(
-                existing_impression=existing_impression or "暂无印象",
-                history_context=history_context[:max_history_chars],
-                message=message[:max_message_chars]
-            )
+        if self._impression_template is not None:
+            return self._impression_template.render({
+                'existing_impression': existing_impression or "暂无印象",
+                'history_context': history_context[:max_history_chars],
+                'message': message[:max_message_chars]
+            })
 
         # 默认增量更新提示词
         if existing_impression:
@@ -375,11 +505,16 @@ class TextImpressionService:
                 # 使用更新方式
                 impression.set_impression_with_version(impression_text)
                 impression.save()
-                
+
                 # 记录版本变化
                 change_summary = impression.get_impression_change_summary()
                 logger.debug(f"印象更新: 用户 {user_id}, {change_summary}")
-            
+
+            # 失效工具层的印象查询缓存，确保后续读取到最新数据
+            from ..components.tools import invalidate_impression_cache
+            invalidate_impression_cache(user_id)
+            invalidate_impression_instance(user_id)
+
             logger.debug(f"印象已保存: 用户 {user_id}, 印象: {impression_text[:50]}...")
             return True
             
@@ -388,22 +523,44 @@ class TextImpressionService:
             return False
 
     def get_impression(self, user_id: str) -> Optional[UserImpression]:
-        """获取用户印象"""
+        """获取用户印象（带60秒读穿缓存）"""
+        now = time.monotonic()
+        entry = _ORM_CACHE.get(user_id)
+        if entry is not None and now - entry[0] < _ORM_CACHE_TTL:
+            return entry[1]
+
         try:
-            return UserImpression.get_or_create(user_id=user_id)[0]
+            impression = UserImpression.get_or_create(user_id=user_id)[0]
         except Exception as e:
             logger.error(f"获取印象失败: {str(e)}")
             return None
 
+        if len(_ORM_CACHE) >= _ORM_CACHE_MAXSIZE:
+            # 先清过期项，仍然过大时直接清空（重建成本只是一次SELECT）
+            expired = [key for key, (ts, _) in _ORM_CACHE.items() if now - ts >= _ORM_CACHE_TTL]
+            for key in expired:
+                _ORM_CACHE.pop(key, None)
+            if len(_ORM_CACHE) >= _ORM_CACHE_MAXSIZE:
+                _ORM_CACHE.clear()
+
+        _ORM_CACHE[user_id] = (now, impression)
+        return impression
+
     def search_impressions(self, keyword: str, limit: int = 10) -> List[UserImpression]:
-        """搜索印象"""
+        """搜索印象 - 关键词匹配在SQLite内完成（LIKE），覆盖全部8个维度字段"""
         try:
-            impressions = UserImpression.select().where(
+            condition = (
                 UserImpression.personality_traits.contains(keyword) |
                 UserImpression.interests_hobbies.contains(keyword) |
-                UserImpression.communication_style.contains(keyword)
-            ).limit(limit)
-            
+                UserImpression.communication_style.contains(keyword) |
+                UserImpression.emotional_tendencies.contains(keyword) |
+                UserImpression.behavioral_patterns.contains(keyword) |
+                UserImpression.values_attitudes.contains(keyword) |
+                UserImpression.relationship_preferences.contains(keyword) |
+                UserImpression.growth_development.contains(keyword)
+            )
+            impressions = UserImpression.select().where(condition).limit(limit)
+
             return list(impressions)
         except Exception as e:
             logger.error(f"搜索印象失败: {str(e)}")
@@ -424,7 +581,7 @@ class TextImpressionService:
                 UserImpression.user_id == user_id
             ).first()
         except Exception as e:
-            print(f"获取印象失败: {str(e)}")
+            logger.error("获取印象失败: %s", e)
             return None
 
     async def update_dimension(self, user_id: str, dimension: str, content: str) -> Tuple[bool, str]:
@@ -435,6 +592,7 @@ class TextImpressionService:
                 return False, "用户不存在"
 
             impression.set_dimension(dimension, content)
+            invalidate_impression_instance(user_id)
             return True, f"{dimension}已更新: {content}"
         except Exception as e:
             return False, f"更新维度失败: {str(e)}"
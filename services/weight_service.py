@@ -3,17 +3,181 @@
 """
 
 import os
+import re
+import json
+import time
+import heapq
+import asyncio
 import hashlib
-from typing import Dict, Any, Tuple, Optional, List, Set
+import logging
+from typing import Dict, Any, Tuple, Optional, List, Set, NamedTuple
 from datetime import datetime
-from collections import defaultdict
+from collections import defaultdict, deque
 
 from ..clients import LLMClient
+from ..utils.llm_cache import llm_result_cache
+from ..utils.prompt_template import PrecompiledTemplate
 from .database_service import DatabaseService
 from src.common.logger import get_logger
 
 logger = get_logger("impression_affection_weight")
 
+# debug开关检查走标准库logger（与components/tools.py同名），宿主的
+# get_logger不保证暴露isEnabledFor
+_std_logger = logging.getLogger("impression_affection_system")
+
+# 常见套话/应答词：必然低权重，评估时直接短路，不消耗LLM调用
+_TRIVIAL_PATTERNS = frozenset({
+    'ok', 'okay', 'yes', 'no',
+    '嗯', '哦', '好', '好的', '是', '不',
+    '嗯嗯', '哈哈', '哈哈哈', '收到', '谢谢', '晚安',
+})
+
+# 默认权重评估提示词 - 使用键值对格式；静态说明块与动态部分拆开：
+# 说明块作为system消息发送，每次调用字节级一致，支持前缀缓存的服务端
+# 可以跨请求复用这部分的KV状态；user消息只剩当前消息和上下文
+_WEIGHT_SYSTEM_PROMPT = "基于消息内容和上下文对话，评估消息权重（0-100）。权重评估标准：高权重(70-100): 包含重要个人信息、兴趣爱好、价值观、情感表达、深度思考、独特观点、生活经历分享；中权重(40-69): 一般日常对话、简单提问、客观陈述、基础信息交流；低权重(0-39): 简单问候、客套话、无实质内容的互动、表情符号。特别注意：结合上下文判断，分享个人喜好、询问对方偏好、表达个人观点都应该给予较高权重。只返回键值对格式：WEIGHT_SCORE: 分数;WEIGHT_LEVEL: high/medium/low;REASON: 评估原因"
+_DEFAULT_WEIGHT_USER_PROMPT = "当前消息: {message};历史上下文: {context}"
+
+# 可选加速：orjson为C实现，JSON后备解析比stdlib json快数倍
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 可选加速：google-re2是线性时间的DFA引擎，不回溯，解析LLM产出的
+# 异常内容也不会卡死；未安装时退回标准库re（见requirements.txt注释）
+try:
+    import re2 as _regex
+except ImportError:
+    _regex = re
+
+# 权重响应解析用的正则，导入时编译一次；三个键值用命名分组合并成
+# 一个alternation，单趟finditer扫描整个响应而不是三次独立search
+_RE_WEIGHT_FIELDS = _regex.compile(
+    r'WEIGHT_SCORE:\s*(?P<score>[\d.]+)'
+    r'|WEIGHT_LEVEL:\s*(?P<level>\w+)'
+    r'|REASON:\s*(?P<reason>.+?)(?:\n|;消息:|$)',
+    _regex.IGNORECASE,
+)
+
+# 批量权重评估：多条消息带编号槽位合并进一条提示词，响应按行解析
+_BATCH_WEIGHT_HEADER = (
+    "请分别评估下面每条消息对了解用户的重要性权重（0-100分）。评估标准："
+    "高权重(70-100): 包含重要个人信息、兴趣爱好、价值观、情感表达、深度思考、独特观点、生活经历分享；"
+    "中权重(40-69): 一般日常对话、简单提问、客观陈述、基础信息交流；"
+    "低权重(0-39): 简单问候、客套话、无实质内容的互动、表情符号。"
+    "请对每条消息各输出一行，格式严格为：\n"
+    "MSG_INDEX: 序号;WEIGHT_SCORE: 分数;WEIGHT_LEVEL: high/medium/low;REASON: 简短原因\n"
+)
+
+_RE_BATCH_LINE = _regex.compile(
+    r'MSG_INDEX:\s*(?P<index>\d+)\s*[;；]?\s*'
+    r'WEIGHT_SCORE:\s*(?P<score>[\d.]+)\s*[;；]?\s*'
+    r'WEIGHT_LEVEL:\s*(?P<level>\w+)',
+    _regex.IGNORECASE,
+)
+
+
+class WeightRecord(NamedTuple):
+    """内存中的单条权重记录（命名字段替代位置下标访问）"""
+
+    message_id: str
+    score: float
+    level: str
+    timestamp: datetime
+    excerpt: str          # 消息内容摘录
+    context_excerpt: str  # 上下文摘录
+    display: str          # 预生成的展示串，读路径直接取用
+
+
+class WeightBatcher:
+    """权重评估微批器
+
+    与印象分析的PromptBatcher同一思路：在很短的聚合窗口内收集并发的
+    权重评估请求，合并成一条带编号槽位的提示词一次性发给LLM，摊薄
+    每次请求的往返和prefill开销；窗口内只有一条时退化为普通单次调用。
+    """
+
+    # 聚合窗口（秒）与单批上限
+    WINDOW_SECONDS = 0.05
+    POLL_INTERVAL = 0.005
+    MAX_BATCH = 6
+
+    def __init__(self, service: "WeightService"):
+        self._service = service
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._worker: Optional[asyncio.Task] = None
+
+    async def submit(self, message: str, context: str) -> Optional[Dict[str, Any]]:
+        """提交一条消息，等待其所在批次完成，返回解析后的权重结果"""
+        self._ensure_worker()
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((message, context, future))
+        return await future
+
+    def _ensure_worker(self):
+        """惰性启动后台聚合任务（需在事件循环内调用）"""
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def _run(self):
+        """后台循环：攒批 -> 发送 -> 按槽位分发结果"""
+        while True:
+            batch = [await self._queue.get()]
+
+            # 在窗口内继续收集，直到凑满一批或超时
+            deadline = time.monotonic() + self.WINDOW_SECONDS
+            while len(batch) < self.MAX_BATCH and time.monotonic() < deadline:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    await asyncio.sleep(self.POLL_INTERVAL)
+
+            try:
+                if len(batch) == 1:
+                    results = [await self._evaluate_single(batch[0][0], batch[0][1])]
+                elif self._service._weight_system_prompt is None:
+                    # 用户自定义了weight_evaluation_prompt：模板是不可拆分的
+                    # 单串，合并进默认批量提示词会绕过用户配置的评估标准，
+                    # 改为逐条并发走单次评估路径
+                    gathered = await asyncio.gather(
+                        *[self._evaluate_single(m, c) for m, c, _ in batch],
+                        return_exceptions=True,
+                    )
+                    results = [
+                        None if isinstance(r, BaseException) else r
+                        for r in gathered
+                    ]
+                else:
+                    results = await self._evaluate_batch(batch)
+            except Exception as e:
+                logger.error("权重批量评估失败: %s", e)
+                results = [None] * len(batch)
+
+            for (_message, _context, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    async def _evaluate_single(self, message: str, context: str) -> Optional[Dict[str, Any]]:
+        """单条请求走原有的单次评估路径"""
+        service = self._service
+        prompt = service._build_weight_prompt(message, context)
+        success, content = await service._call_weight_llm(prompt, system=service._weight_system_prompt)
+        if not success:
+            return None
+        return service._parse_weight_response(content)
+
+    async def _evaluate_batch(self, batch: List[Tuple[str, str, Any]]) -> List[Optional[Dict[str, Any]]]:
+        """多条请求合并为一条批量提示词，一次LLM调用评完"""
+        service = self._service
+        prompt = service._build_batch_weight_prompt([(m, c) for m, c, _ in batch])
+        success, content = await service._call_weight_llm(prompt, system=_BATCH_WEIGHT_HEADER)
+        if not success:
+            return [None] * len(batch)
+        return service._parse_batch_response(content, len(batch))
+
 
 class WeightService:
     """权重评估服务"""
@@ -24,6 +188,17 @@ class WeightService:
         self.weight_config = config.get("weight_filter", {})
         self.prompts_config = config.get("prompts", {})
 
+        # 配置模板（缺省时用默认提示词）初始化时预拆分一次，渲染只做拼接；
+        # 默认提示词的静态说明块走system消息（见模块常量注释），用户自定义
+        # 模板是单串，无法拆分，保持整条作为user消息发送
+        template = self.prompts_config.get("weight_evaluation_prompt", "").strip()
+        if template:
+            self._weight_template = PrecompiledTemplate(template)
+            self._weight_system_prompt = None
+        else:
+            self._weight_template = PrecompiledTemplate(_DEFAULT_WEIGHT_USER_PROMPT)
+            self._weight_system_prompt = _WEIGHT_SYSTEM_PROMPT
+
         # 阈值配置
         self.high_threshold = self.weight_config.get("high_weight_threshold", 70.0)
         self.medium_threshold = self.weight_config.get("medium_weight_threshold", 40.0)
@@ -34,14 +209,32 @@ class WeightService:
         self.weight_llm_client = None
         
         # 内存存储 - 按用户存储消息权重记录
-        self.message_weights = defaultdict(list)  # {user_id: [(message_id, score, level, timestamp), ...]}
+        # 每用户的权重记录用定长deque作环形缓冲：越界时O(1)淘汰最旧记录，
+        # 不再整列切片复制；{user_id: deque[(message_id, score, level, timestamp, ...)]}
+        weight_cache_limit = self.weight_config.get("max_weight_records", 100)
+        self.message_weights = defaultdict(lambda: deque(maxlen=weight_cache_limit))
+        # message_id -> 记录的辅助索引，按message_id查重从线性扫描变为O(1)
+        self.message_index: Dict[str, Dict[str, WeightRecord]] = defaultdict(dict)
+
+        # 记录里保存的消息/上下文摘录长度
+        self.stored_excerpt_len = self.weight_config.get("stored_excerpt_len", 100)
+
+        # 是否对过短/套话消息直接短路为低权重（省掉LLM调用）
+        self.trivial_shortcircuit = self.weight_config.get("trivial_shortcircuit", True)
+
+        # datetime.now()缓存：记录时间戳只用于'%m-%d %H:%M'粒度的展示
+        # 和排序，50毫秒内复用同一对象，突发流量下省掉逐条系统调用
+        self._now_cache: Tuple[float, datetime] = (0.0, datetime.min)
         
         # 数据库服务
         self.db_service = DatabaseService(config)
-        
+
         # 初始化权重评估客户端
         self._init_weight_llm_client()
 
+        # 权重评估微批器：突发并发时把多条评估合并成一次LLM调用
+        self._weight_batcher = WeightBatcher(self)
+
     
 
     def is_message_processed(self, user_id: str, message_id: str = None) -> bool:
@@ -169,36 +362,34 @@ class WeightService:
             # 检查消息是否已处理过（基于message_id去重）
             if self.is_message_processed(normalized_user_id, message_id):
                 logger.debug(f"消息已处理，跳过权重评估: 用户 {normalized_user_id}, message_id {message_id}")
-                # 返回已存在的权重评估结果
-                user_messages = self.message_weights.get(normalized_user_id, [])
-                for msg_record in user_messages:
-                    if msg_record[0] == message_id:  # message_id matches
-                        return True, msg_record[1], msg_record[2]  # score, level
-
-            # 生成提示词（包含上下文）
-            prompt = self._build_weight_prompt(message, context)
-
-            # 选择LLM客户端进行评估
-            if self.use_custom_weight_model and self.weight_llm_client:
-                # 使用自定义权重模型
-                success, content = await self.weight_llm_client.generate_weight_evaluation(prompt)
+                # 返回已存在的权重评估结果（辅助索引O(1)定位）
+                msg_record = self.message_index.get(normalized_user_id, {}).get(message_id)
+                if msg_record is not None:
+                    return True, msg_record.score, msg_record.level
+
+            # 过短或套话消息必然低权重，直接记为低分，不消耗LLM调用
+            stripped = message.strip()
+            if self.trivial_shortcircuit and (len(stripped) < 4 or stripped.lower() in _TRIVIAL_PATTERNS):
+                self._save_weight(normalized_user_id, message_id, message, context, 15.0, "low")
+                return True, 15.0, "low"
+
+            # 相同消息+上下文的权重评估结果直接复用，跳过LLM往返
+            cache_key = llm_result_cache.make_key("weight", message, context)
+            cached = llm_result_cache.get(cache_key)
+
+            if cached is not None:
+                weight_score, weight_level = cached
             else:
-                # 使用默认LLM客户端
-                success, content = await self.llm_client.generate_weight_evaluation(prompt)
+                # 经微批器提交：聚合窗口内的并发请求合并成一次LLM调用
+                result = await self._weight_batcher.submit(message, context)
 
-            if not success:
-                # 评估失败，使用默认权重
-                return self._save_default_weight(normalized_user_id, message_id, message, context)
+                if not result:
+                    # 评估或解析失败，使用默认权重
+                    return self._save_default_weight(normalized_user_id, message_id, message, context)
 
-            # 解析结果
-            result = self._parse_weight_response(content)
-
-            if not result:
-                # 解析失败，使用默认权重
-                return self._save_default_weight(normalized_user_id, message_id, message, context)
-
-            weight_score = float(result.get("weight_score", 0.0))
-            weight_level = result.get("weight_level", "low")
+                weight_score = float(result.get("weight_score", 0.0))
+                weight_level = result.get("weight_level", "low")
+                llm_result_cache.put(cache_key, (weight_score, weight_level))
 
             # 保存到内存
             self._save_weight(normalized_user_id, message_id, message, context, weight_score, weight_level)
@@ -211,52 +402,87 @@ class WeightService:
         except Exception as e:
             return False, 0.0, f"评估权重失败: {str(e)}"
 
+    async def _call_weight_llm(self, prompt: str, system: Optional[str] = None) -> Tuple[bool, str]:
+        """按配置选择权重评估用的LLM客户端并发起调用"""
+        if self.use_custom_weight_model and self.weight_llm_client:
+            # 使用自定义权重模型
+            return await self.weight_llm_client.generate_weight_evaluation(prompt, system=system)
+        # 使用默认LLM客户端
+        return await self.llm_client.generate_weight_evaluation(prompt, system=system)
+
     def _build_weight_prompt(self, message: str, context: str) -> str:
-        """构建权重评估提示词"""
-        template = self.prompts_config.get("weight_evaluation_prompt", "").strip()
+        """构建权重评估提示词（配置模板或默认模板，均已预拆分）"""
+        return self._weight_template.render({'message': message, 'context': context})
 
-        if template:
-            return template.format(message=message, context=context)
+    def _build_batch_weight_prompt(self, items: List[Tuple[str, str]]) -> str:
+        """构建批量权重评估提示词正文，每条消息占一个编号槽位
 
-        # 默认提示词 - 使用键值对格式
-        return f"""基于消息内容和上下文对话，评估消息权重（0-100）。权重评估标准：高权重(70-100): 包含重要个人信息、兴趣爱好、价值观、情感表达、深度思考、独特观点、生活经历分享；中权重(40-69): 一般日常对话、简单提问、客观陈述、基础信息交流；低权重(0-39): 简单问候、客套话、无实质内容的互动、表情符号。特别注意：结合上下文判断，分享个人喜好、询问对方偏好、表达个人观点都应该给予较高权重。只返回键值对格式：WEIGHT_SCORE: 分数;WEIGHT_LEVEL: high/medium/low;REASON: 评估原因;当前消息: {message};历史上下文: {context}"""
+        静态的批量评估说明(_BATCH_WEIGHT_HEADER)由调用方作为system
+        消息单独发送，不在正文里重复。
+        """
+        parts = []
+        for index, (message, context) in enumerate(items, start=1):
+            parts.append(f"消息{index}: {message}")
+            parts.append(f"上下文{index}: {context}")
+        return "\n".join(parts)
+
+    def _parse_batch_response(self, content: str, expected: int) -> List[Optional[Dict[str, Any]]]:
+        """解析批量权重评估响应，按MSG_INDEX对回各槽位；缺失槽位为None"""
+        results: List[Optional[Dict[str, Any]]] = [None] * expected
+        for match in _RE_BATCH_LINE.finditer(content):
+            index = int(match.group('index')) - 1
+            if not (0 <= index < expected) or results[index] is not None:
+                continue
+            try:
+                score = float(match.group('score'))
+            except ValueError:
+                continue
+            results[index] = {
+                "weight_score": score,
+                "weight_level": match.group('level').strip().lower(),
+            }
+        return results
 
     def _parse_weight_response(self, content: str) -> Optional[Dict[str, Any]]:
         """解析权重评估响应 - 支持键值对和JSON两种格式"""
-        import logging
-        import re
-        import json
-        
-        logger = logging.getLogger("impression_affection_system")
-        
         # 清理内容
         content = content.strip()
-        
-        # 如果内容太短
+
+        # 如果内容太短；%r延迟到真正输出时才格式化
         if len(content) < 10:
-            logger.error(f"LLM响应太短: {repr(content)}")
+            logger.error("LLM响应太短: %r", content)
             return None
-        
-        # 方法1: 尝试提取键值对格式
-        score_match = re.search(r'WEIGHT_SCORE:\s*([\d.]+)', content, re.IGNORECASE)
-        level_match = re.search(r'WEIGHT_LEVEL:\s*(\w+)', content, re.IGNORECASE)
-        reason_match = re.search(r'REASON:\s*(.+?)(?:\n|;消息:|$)', content, re.IGNORECASE)
-        
+
+        # debug关闭时（生产默认）跳过下面对结果dict和长响应的格式化
+        debug_enabled = _std_logger.isEnabledFor(logging.DEBUG)
+
+        # 方法1: 尝试提取键值对格式 - 单趟扫描，命中首个匹配即生效
         result = {}
-        if score_match:
-            try:
-                result["weight_score"] = float(score_match.group(1))
-            except:
-                result["weight_score"] = 0.0
-        if level_match:
-            result["weight_level"] = level_match.group(1).strip().lower()
-        if reason_match:
-            result["reason"] = reason_match.group(1).strip()
-        
-        if result and "weight_score" in result:
-            logger.debug(f"提取到键值对格式权重数据: {result}")
+        saw_score = False
+        for match in _RE_WEIGHT_FIELDS.finditer(content):
+            group = match.lastgroup
+            if group == 'score' and not saw_score:
+                saw_score = True
+                try:
+                    result["weight_score"] = float(match.group('score'))
+                except ValueError:
+                    pass
+            elif group == 'level' and "weight_level" not in result:
+                result["weight_level"] = match.group('level').strip().lower()
+            elif group == 'reason' and "reason" not in result:
+                result["reason"] = match.group('reason').strip()
+
+        if "weight_score" in result:
+            if debug_enabled:
+                logger.debug("提取到键值对格式权重数据: %s", result)
             return result
-        
+
+        # 出现过WEIGHT_SCORE:说明响应是键值对形态，只是分数没解析出来；
+        # 直接判失败，不再为它扫一遍JSON后备路径
+        if saw_score:
+            logger.error("WEIGHT_SCORE分数无法解析: %r", content)
+            return None
+
         # 方法2: 尝试解析JSON格式（作为后备）
         try:
             # 查找JSON部分（从第一个{到最后一个}）
@@ -265,32 +491,60 @@ class WeightService:
             
             if start >= 0 and end >= 0 and end > start:
                 json_str = content[start:end+1]
-                json_result = json.loads(json_str)
-                
+                json_result = orjson.loads(json_str) if orjson else json.loads(json_str)
+
                 if isinstance(json_result, dict) and "weight_score" in json_result:
-                    logger.debug(f"提取到JSON格式权重数据: {json_result}")
+                    if debug_enabled:
+                        logger.debug("提取到JSON格式权重数据: %s", json_result)
                     return json_result
-        except json.JSONDecodeError as e:
-            logger.debug(f"JSON解析失败: {e}")
-        
-        logger.error(f"无法提取权重数据: {repr(content)}")
+        # orjson.JSONDecodeError与json.JSONDecodeError都继承ValueError
+        except ValueError as e:
+            if debug_enabled:
+                logger.debug("JSON解析失败: %s", e)
+
+        logger.error("无法提取权重数据: %r", content)
         return None
 
+    def _now(self) -> datetime:
+        """取当前时间（50毫秒内复用缓存值，见__init__注释）"""
+        tick = time.monotonic()
+        if tick - self._now_cache[0] < 0.050:
+            return self._now_cache[1]
+        now = datetime.now()
+        self._now_cache = (tick, now)
+        return now
+
     def _save_weight(self, user_id: str, message_id: str, message: str, context: str, weight_score: float, weight_level: str):
         """保存权重评估结果到内存"""
-        self.message_weights[user_id].append((
-            message_id, 
-            weight_score, 
-            weight_level, 
-            datetime.now(),
-            message[:100],  # 保存消息内容的前100字符
-            context[:100]   # 保存上下文的前100字符
-        ))
-        
-        # 限制每个用户保存的记录数，从配置读取
-        weight_cache_limit = self.config.get("weight_filter", {}).get("max_weight_records", 100)
-        if len(self.message_weights[user_id]) > weight_cache_limit:
-            self.message_weights[user_id] = self.message_weights[user_id][-weight_cache_limit:]
+        records = self.message_weights[user_id]
+        index = self.message_index[user_id]
+
+        # 缓冲已满时deque会自动淘汰最旧记录，同步清掉它的索引项
+        if records.maxlen is not None and len(records) == records.maxlen:
+            index.pop(records[0].message_id, None)
+
+        # 长度够短时直接引用原串，不做切片拷贝
+        excerpt_len = self.stored_excerpt_len
+        stored_message = message if len(message) <= excerpt_len else message[:excerpt_len]
+        stored_context = context if len(context) <= excerpt_len else context[:excerpt_len]
+
+        # 记录不可变，展示串在写入时生成一次；读路径（每次印象构建都会
+        # 调用get_filtered_messages）不再逐条做strftime和f-string格式化
+        timestamp = self._now()
+        weight_part = f" (权重: {weight_score:.1f}, 等级: {weight_level})" if weight_score > 0 else ""
+        display = f"[{timestamp.strftime('%m-%d %H:%M')}] {stored_message}{weight_part}"
+
+        record = WeightRecord(
+            message_id=message_id,
+            score=weight_score,
+            level=weight_level,
+            timestamp=timestamp,
+            excerpt=stored_message,
+            context_excerpt=stored_context,
+            display=display,
+        )
+        records.append(record)
+        index[message_id] = record
 
     def _save_default_weight(self, user_id: str, message_id: str, message: str, context: str) -> Tuple[bool, float, str]:
         """保存默认权重"""
@@ -305,13 +559,14 @@ class WeightService:
         self._save_weight(user_id, message_id, message, context, weight_score, weight_level)
         return True, weight_score, weight_level
 
-    def get_filtered_messages(self, user_id: str, limit: int = None) -> Tuple[str, list]:
+    def get_filtered_messages(self, user_id: str, limit: int = None, max_chars: int = None) -> Tuple[str, list]:
         """
         获取筛选后的消息用于印象构建（包含上下文）
 
         Args:
             user_id: 用户ID
             limit: 最大消息数，如果为None则从配置读取
+            max_chars: 上下文字符数上限，如果为None则从配置读取
 
         Returns:
             (上下文字符串, 消息ID列表)
@@ -321,6 +576,11 @@ class WeightService:
             history_config = self.config.get("history", {})
             limit = history_config.get("max_messages", 20)
 
+        # 上下文长度上限与下游提示词截断保持一致，在源头停止拼接，
+        # 避免先构建超长字符串再被切片复制一次
+        if max_chars is None:
+            max_chars = self.prompts_config.get("max_history_chars", 2000)
+
         if self.filter_mode == "disabled":
             return "", []
 
@@ -355,34 +615,32 @@ class WeightService:
                 "content_hash": db_msg.get("content_hash", "")
             })
         
+        # 筛选阈值在循环外确定一次：selective/balanced用对应阈值，
+        # 其余模式用-inf表示全部通过，循环体内只剩一次数值比较
+        if self.filter_mode == "selective":
+            include_threshold = self.high_threshold
+        elif self.filter_mode == "balanced":
+            include_threshold = self.medium_threshold
+        else:
+            include_threshold = float('-inf')
+
         # 处理内存中的消息权重记录
         for msg_record in user_messages:
-            message_id, weight_score, weight_level, timestamp, message_content, context = msg_record
-            
-            # 根据筛选模式过滤
-            should_include = False
-            if self.filter_mode == "selective":
-                should_include = weight_score >= self.high_threshold
-            elif self.filter_mode == "balanced":
-                should_include = weight_score >= self.medium_threshold
-            else:  # 默认包含所有消息
-                should_include = True
-            
-            if should_include:
+            if msg_record.score >= include_threshold:
                 filtered_messages.append({
-                    "message_id": message_id,
-                    "weight_score": weight_score,
-                    "weight_level": weight_level,
-                    "timestamp": timestamp,
-                    "content": message_content,
+                    "message_id": msg_record.message_id,
+                    "weight_score": msg_record.score,
+                    "weight_level": msg_record.level,
+                    "timestamp": msg_record.timestamp,
+                    "content": msg_record.excerpt,
                     "source": "memory",
-                    "context": context,
-                    "content_hash": hashlib.md5(message_content.encode('utf-8')).hexdigest()
+                    "context": msg_record.context_excerpt,
+                    "display": msg_record.display,
+                    "content_hash": hashlib.md5(msg_record.excerpt.encode('utf-8')).hexdigest()
                 })
 
-        # 按时间倒序排列，取前limit条
-        filtered_messages.sort(key=lambda x: x["timestamp"], reverse=True)
-        filtered_messages = filtered_messages[:limit]
+        # 按时间取最近limit条：部分选择O(N log k)，不用对全部记录排序
+        filtered_messages = heapq.nlargest(limit, filtered_messages, key=lambda x: x["timestamp"])
 
         # 统计过滤结果
         total_db_messages = len(db_messages)
@@ -401,26 +659,33 @@ class WeightService:
         
         # 添加完整的对话上下文，不分离历史和当前消息
         contexts.append(f"用户 {normalized_user_id} 的对话记录:")
-        
+        total_chars = len(contexts[0])
+
         for msg in filtered_messages:
-            timestamp = msg["timestamp"]
-            content = msg["content"]
-            weight_score = msg["weight_score"]
-            weight_level = msg["weight_level"]
-            source = msg["source"]
-            
-            if isinstance(timestamp, datetime):
-                time_str = timestamp.strftime('%m-%d %H:%M')
-            else:
-                time_str = str(timestamp)
-            
-            context_str = f"[{time_str}] {content}"
-            if weight_score > 0:
-                context_str += f" (权重: {weight_score:.1f}, 等级: {weight_level})"
-            if source == "database":
-                context_str += " [历史]"
-            
+            # 内存记录的展示串在_save_weight时已预生成，这里直接取用；
+            # 数据库历史消息仍然逐条格式化
+            context_str = msg.get("display")
+            if context_str is None:
+                timestamp = msg["timestamp"]
+                if isinstance(timestamp, datetime):
+                    time_str = timestamp.strftime('%m-%d %H:%M')
+                else:
+                    time_str = str(timestamp)
+
+                # 各段先就位再拼一次，避免+=逐段产生中间字符串
+                weight_part = (
+                    f" (权重: {msg['weight_score']:.1f}, 等级: {msg['weight_level']})"
+                    if msg["weight_score"] > 0 else ""
+                )
+                history_part = " [历史]" if msg["source"] == "database" else ""
+                context_str = f"[{time_str}] {msg['content']}{weight_part}{history_part}"
+
+            # 超出长度上限即停止；未纳入上下文的消息也不应标记为已处理
+            if total_chars + len(context_str) + 1 > max_chars:
+                break
+
             contexts.append(context_str)
+            total_chars += len(context_str) + 1
             message_ids.append(msg["message_id"])
 
         result = "\n".join(contexts)
@@ -509,7 +774,7 @@ class WeightService:
         try:
             return self.db_service.search_user_messages(user_id, keyword, limit)
         except Exception as e:
-            print(f"搜索用户消息失败: {str(e)}")
+            logger.error("搜索用户消息失败: %s", e)
             return []
 
     def get_recent_interactions(self, user_id: str, hours_back: int = 24) -> list:
@@ -529,7 +794,7 @@ class WeightService:
         try:
             return self.db_service.get_recent_interactions(user_id, hours_back)
         except Exception as e:
-            print(f"获取最近互动失败: {str(e)}")
+            logger.error("获取最近互动失败: %s", e)
             return []
 
     def get_historical_context_for_weight(self, user_id: str) -> str:
@@ -4,5 +4,7 @@
 
 from .constants import AFFECTION_LEVELS
 from .helpers import get_affection_level
+from .llm_cache import LLMResultCache, llm_result_cache
+from .prompt_template import PrecompiledTemplate
 
-__all__ = ['AFFECTION_LEVELS', 'get_affection_level']
+__all__ = ['AFFECTION_LEVELS', 'get_affection_level', 'LLMResultCache', 'llm_result_cache', 'PrecompiledTemplate']
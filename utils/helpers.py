@@ -2,8 +2,26 @@
 工具函数
 """
 
+import json
+import re
+import bisect
 from typing import Dict, Tuple, Any
 
+from .constants import AFFECTION_LEVELS
+
+# 可选加速：orjson为C实现，解析比stdlib json快数倍（未安装时回退）
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 提取JSON对象用的正则，导入时编译一次
+_RE_JSON_OBJ = re.compile(r'\{.*\}', re.DOTALL)
+
+# 按区间上界排序的等级表，查询走二分而不是逐区间线性扫描
+_LEVEL_RANGES = sorted(AFFECTION_LEVELS.items(), key=lambda item: item[0][0])
+_LEVEL_UPPERS = [upper for (_lower, upper), _label in _LEVEL_RANGES]
+
 
 def get_affection_level(score: float) -> str:
     """
@@ -15,14 +33,14 @@ def get_affection_level(score: float) -> str:
     Returns:
         好感度等级字符串
     """
-    from .constants import AFFECTION_LEVELS
-
     if not isinstance(score, (int, float)):
         return "一般"
 
     score = float(score)
 
-    for (min_score, max_score), level in AFFECTION_LEVELS.items():
+    index = bisect.bisect_left(_LEVEL_UPPERS, score)
+    if index < len(_LEVEL_RANGES):
+        (min_score, max_score), level = _LEVEL_RANGES[index]
         if min_score <= score <= max_score:
             return level
 
@@ -60,17 +78,16 @@ def safe_json_parse(json_str: str) -> Dict[str, Any]:
     Returns:
         解析后的字典
     """
-    import json
-    import re
-
+    loads = orjson.loads if orjson else json.loads
     try:
-        return json.loads(json_str.strip())
-    except json.JSONDecodeError:
+        return loads(json_str.strip())
+    # orjson.JSONDecodeError与json.JSONDecodeError都继承ValueError
+    except ValueError:
         # 尝试提取JSON
-        json_match = re.search(r'\{.*\}', json_str, re.DOTALL)
+        json_match = _RE_JSON_OBJ.search(json_str)
         if json_match:
             try:
-                return json.loads(json_match.group())
+                return loads(json_match.group())
             except:
                 pass
     return {}
@@ -0,0 +1,57 @@
+"""
+LLM结果缓存 - 以输入内容哈希为键的进程内LRU缓存
+
+大量用户消息是近似重复的（"hi"、"ok"、表情、复读等），对同样的输入
+重复调用LLM纯属浪费。各服务把解析后的结果按内容哈希缓存，命中时
+直接复用，跳过整个LLM往返。
+"""
+
+import hashlib
+from collections import OrderedDict
+from typing import Any, Optional
+
+
+class LLMResultCache:
+    """进程内LRU缓存 - 键为调用类型+输入文本的SHA1"""
+
+    def __init__(self, maxsize: int = 2048):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+
+    @staticmethod
+    def make_key(kind: str, message: str, context: str = "") -> str:
+        """
+        生成缓存键
+
+        Args:
+            kind: 调用类型（impression/affection/weight等），隔离不同提示词模板
+            message: 当前消息内容
+            context: 上下文（只取前500字符参与哈希，避免长文本哈希开销）
+
+        Returns:
+            SHA1十六进制摘要
+        """
+        raw = f"{kind}|{message}|{context[:500]}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """获取缓存值，未命中返回None；命中时刷新LRU顺序"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, value: Any):
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """清空缓存"""
+        self._entries.clear()
+
+
+# 进程内共享实例
+llm_result_cache = LLMResultCache()
@@ -0,0 +1,33 @@
+"""
+预解析的提示词模板
+
+str.format每次调用都要重新扫描模板、解析字段名和格式说明符。
+配置里的模板在进程生命周期内不会变化，这里在服务初始化时
+用string.Formatter().parse把模板拆成(字面量, 字段名)片段，
+之后每次渲染只做列表拼接，省去重复解析的开销。
+"""
+
+from string import Formatter
+from typing import Dict, List, Optional, Tuple
+
+
+class PrecompiledTemplate:
+    """预拆分的format模板，渲染时只做字符串拼接"""
+
+    __slots__ = ('_parts',)
+
+    def __init__(self, template: str):
+        self._parts: List[Tuple[str, Optional[str]]] = [
+            (literal, field_name)
+            for literal, field_name, _spec, _conv in Formatter().parse(template)
+        ]
+
+    def render(self, values: Dict[str, str]) -> str:
+        """按预拆分的片段拼接结果，缺失的字段按空串处理"""
+        pieces = []
+        for literal, field_name in self._parts:
+            if literal:
+                pieces.append(literal)
+            if field_name is not None:
+                pieces.append(values.get(field_name, ""))
+        return ''.join(pieces)